@@ -1,6 +1,119 @@
-from flask import Flask, jsonify, request, render_template
+import gc
+import os
+import tempfile
+import time
+from urllib.parse import quote
+
+from flask import Flask, Response, g, jsonify, request, render_template, send_file
+
+from batch import export_sources, parse_manifest, resolve_under
+from batch_jobs import BatchJobManager
+from clean_jobs import CleanJobManager
+from export_jobs import ExportJobManager
+from instrumentation import REGISTRY
+from jobs import JobQueueFull
+from result_cache import ResultCache
+from xml_scanner import scan_path, scan_stream
 
 app = Flask(__name__)
+app.config.update(
+    # The only folder export, batch and clean requests may read from; required
+    MERGE_SOURCE_ROOT=os.environ.get('MERGE_SOURCE_ROOT'),
+    MERGE_OUTPUT_DIR=os.environ.get('MERGE_OUTPUT_DIR', os.path.join(tempfile.gettempdir(), 'indesign-exports')),
+    MERGE_WORKERS=int(os.environ.get('MERGE_WORKERS', 2)),
+    MERGE_WRITER_PROCESSES=int(os.environ.get('MERGE_WRITER_PROCESSES', 1)),
+    MERGE_QUEUE_DEPTH=int(os.environ.get('MERGE_QUEUE_DEPTH', 16)),
+    MERGE_JOB_TTL=int(os.environ.get('MERGE_JOB_TTL', 3600)),
+    BATCH_WORKERS=int(os.environ.get('BATCH_WORKERS', 4)),
+    CLEAN_WORKERS=int(os.environ.get('CLEAN_WORKERS', 2)),
+    BATCH_QUEUE_DEPTH=int(os.environ.get('BATCH_QUEUE_DEPTH', 4)),
+    RESULT_CACHE_BYTES=int(os.environ.get('RESULT_CACHE_BYTES', 2 << 30)),
+    # Input files whose hashes are remembered for answering exports from the cache
+    RESULT_CACHE_HASHES=int(os.environ.get('RESULT_CACHE_HASHES', 100000)),
+    # Keep a JSON trace of every export job next to its status file
+    MERGE_TRACES=os.environ.get('MERGE_TRACES') == '1',
+    # Where worker processes pool their metrics, so /metrics reports them all
+    METRICS_DIR=os.environ.get('METRICS_DIR'),
+)
+if not app.config['MERGE_SOURCE_ROOT']:
+    raise RuntimeError("Set MERGE_SOURCE_ROOT to the folder the service may read source files from")
+app.config.setdefault('RESULT_CACHE_DIR', os.environ.get(
+    'RESULT_CACHE_DIR', os.path.join(app.config['MERGE_OUTPUT_DIR'], 'cache')))
+
+result_cache = ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_BYTES'],
+                           app.config['RESULT_CACHE_HASHES'])
+
+export_jobs = ExportJobManager(
+    app.config['MERGE_OUTPUT_DIR'],
+    max_workers=app.config['MERGE_WORKERS'],
+    max_queued=app.config['MERGE_QUEUE_DEPTH'],
+    job_ttl=app.config['MERGE_JOB_TTL'],
+    cache=result_cache,
+    writer_processes=app.config['MERGE_WRITER_PROCESSES'],
+    traces=app.config['MERGE_TRACES'],
+)
+
+clean_jobs = CleanJobManager(
+    os.path.join(app.config['MERGE_OUTPUT_DIR'], 'clean'),
+    max_workers=app.config['CLEAN_WORKERS'],
+    max_queued=app.config['MERGE_QUEUE_DEPTH'],
+    job_ttl=app.config['MERGE_JOB_TTL'],
+)
+
+batch_jobs = BatchJobManager(
+    app.config['MERGE_SOURCE_ROOT'],
+    os.path.join(app.config['MERGE_OUTPUT_DIR'], 'batch'),
+    workers=app.config['BATCH_WORKERS'],
+    max_batches=app.config['BATCH_QUEUE_DEPTH'],
+    job_ttl=app.config['MERGE_JOB_TTL'],
+)
+
+if app.config['METRICS_DIR']:
+    REGISTRY.share(app.config['METRICS_DIR'])
+
+HTTP_SECONDS = REGISTRY.histogram('http_request_seconds', "Seconds to answer a request, by route",
+                                  ('route', 'method', 'status'))
+HTTP_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', "Requests being handled")
+HTTP_REQUEST_BYTES = REGISTRY.counter('http_request_bytes_total', "Request body bytes received, by route", ('route',))
+HTTP_RESPONSE_BYTES = REGISTRY.counter('http_response_bytes_total',
+                                       "Response body bytes sent, by route, where known up front", ('route',))
+REGISTRY.gauge('export_jobs_queued', "Export jobs waiting for a worker thread").set_function(
+    lambda: export_jobs.count('queued'))
+REGISTRY.gauge('export_jobs_running', "Export jobs being merged").set_function(
+    lambda: export_jobs.count('running'))
+
+
+def resolve_source(path):
+    """Resolve path against MERGE_SOURCE_ROOT, refusing anything outside it"""
+    return resolve_under(app.config['MERGE_SOURCE_ROOT'], path)
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    HTTP_REQUEST_BYTES.inc(request.content_length or 0, route=route_label())
+
+
+@app.after_request
+def record_request(response):
+    """Time the request; streamed bodies are timed to their first byte"""
+    route = route_label()
+    HTTP_SECONDS.observe(time.perf_counter() - g.request_started, route=route, method=request.method,
+                         status=response.status_code)
+    HTTP_RESPONSE_BYTES.inc(response.content_length or 0, route=route)
+    return response
+
+
+@app.teardown_request
+def end_request(error=None):
+    if 'request_started' in g:
+        HTTP_IN_FLIGHT.dec()
+
 
 @app.route('/')
 def home():
@@ -8,18 +121,265 @@ def home():
 
 @app.route('/export_pdf', methods=['POST'])
 def export_pdf():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Send a JSON object with the files or folder to merge"}), 400
     filename = data.get('filename', 'default.pdf')
-    return jsonify({"status": "success", "message": f"PDF exported as {filename}"})
+    if not isinstance(filename, str):
+        return jsonify({"status": "error", "message": '"filename" must be a string'}), 400
+    try:
+        pdf_files = export_sources(data, app.config['MERGE_SOURCE_ROOT'])
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not pdf_files:
+        return jsonify({"status": "error", "message": "No PDF files to merge"}), 400
+
+    # Bookmarks per file by default, as the PdfMerger export had
+    options = {'outline': bool(data.get('outline', True)), 'dedup': bool(data.get('dedup'))}
+    # Hashing is left to the merge job; only files it has hashed before are looked up
+    result_id = result_cache.known_key(pdf_files, **options)
+    cached = result_cache.get(result_id) if result_id else None
+    if cached is not None:
+        if result_id in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            _, info = cached
+            response = jsonify(dict(info, status="done", cached=True, filename=filename, result_id=result_id,
+                                    download_url=f"/results/{result_id}?filename={quote(filename)}"))
+        response.set_etag(result_id)
+        return response
+
+    try:
+        job = export_jobs.submit(pdf_files, filename, cache_key=result_id, **options)
+    except JobQueueFull as e:
+        response = jsonify({"status": "busy", "message": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    return jsonify({
+        "status": "queued",
+        "message": f"PDF export of {len(pdf_files)} files queued as {filename}",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+        "download_url": f"/jobs/{job.job_id}/download",
+    }), 202
 
-@app.route('/find_xml_tags', methods=['GET'])
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = export_jobs.get(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    """The stage-by-stage trace of a finished job, kept when MERGE_TRACES=1"""
+    if export_jobs.get(job_id) is None or not os.path.isfile(export_jobs.trace_path(job_id)):
+        return jsonify({"status": "error", "message": "No trace for this job"}), 404
+    return send_file(export_jobs.trace_path(job_id), mimetype='application/json')
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not export_jobs.cancel(job_id):
+        return jsonify({"status": "error", "message": "Job is not running in this worker"}), 404
+    return jsonify({"status": "cancelling", "job_id": job_id})
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    status = export_jobs.get(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    if status['status'] != 'done':
+        return jsonify({"status": status['status'], "message": "Export is not finished"}), 409
+    return send_file(export_jobs.output_path(job_id), mimetype='application/pdf',
+                     as_attachment=True, download_name=status['filename'],
+                     etag=status.get('result_id') or True)
+
+@app.route('/results/<result_id>', methods=['GET'])
+def download_result(result_id):
+    """Serve a cached export by its content key; ETag is the key itself"""
+    cached = result_cache.get(result_id)
+    if cached is None:
+        return jsonify({"status": "error", "message": "Unknown result"}), 404
+    path, _ = cached
+    return send_file(path, mimetype='application/pdf', as_attachment=True,
+                     download_name=request.args.get('filename', 'merged.pdf'), etag=result_id)
+
+@app.route('/find_xml_tags', methods=['GET', 'POST'])
 def find_xml_tags():
-    tags = ['ce:para', 'ce:title', 'ce:section', 'ce:list']
-    return jsonify({"tags": tags})
+    """Scan an XML/IDML document for tags.
+
+    The document is a server-side ?path= under MERGE_SOURCE_ROOT, an
+    uploaded 'file' form field, or the raw request body, which is read as
+    a stream. ?locations=1 adds XPath-like locations, limited to the tags
+    listed in ?tags=a,b if given.
+    """
+    locations = request.args.get('locations', '').lower() in ('1', 'true', 'yes')
+    tags = [t for t in request.args.get('tags', '').split(',') if t] or None
+    try:
+        if request.args.get('path'):
+            path = resolve_source(request.args['path'])
+            if not os.path.isfile(path):
+                return jsonify({"status": "error", "message": "File not found"}), 404
+            result = scan_path(path, locations, tags)
+        elif request.method == 'POST' and request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({"status": "error", "message": "No file uploaded"}), 400
+            result = scan_stream(upload.stream, locations, tags)
+        elif request.method == 'POST':
+            result = scan_stream(request.stream, locations, tags)
+        else:
+            return jsonify({"status": "error", "message": "Pass ?path= or POST a document"}), 400
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Queue a manifest of documents and operations as a batch.
+
+    Items are the same as for batch.py; paths are relative to
+    MERGE_SOURCE_ROOT. Poll the status_url, and the log_url for the NDJSON
+    result records; files the items write are served under files_url.
+    """
+    try:
+        items = parse_manifest(request.get_data(as_text=True))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid manifest: {e}"}), 400
+
+    try:
+        job = batch_jobs.submit(items)
+    except JobQueueFull as e:
+        response = jsonify({"status": "busy", "message": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    return jsonify({
+        "status": "queued",
+        "message": f"Batch of {len(items)} items queued",
+        "batch_id": job.job_id,
+        "status_url": f"/batch/{job.job_id}",
+        "log_url": f"/batch/{job.job_id}/log",
+        "files_url": f"/batch/{job.job_id}/files/",
+    }), 202
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    status = batch_jobs.get(batch_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown batch"}), 404
+    return jsonify(status)
+
+@app.route('/batch/<batch_id>/log', methods=['GET'])
+def batch_log(batch_id):
+    """NDJSON records of the items done so far, from byte ?offset=.
+
+    X-Next-Offset is the offset to ask for on the next poll.
+    """
+    if batch_jobs.get(batch_id) is None:
+        return jsonify({"status": "error", "message": "Unknown batch"}), 404
+    try:
+        data, offset = batch_jobs.read_log(batch_id, max(0, request.args.get('offset', 0, type=int)))
+    except OSError:
+        return jsonify({"status": "error", "message": "Unknown batch"}), 404
+    response = Response(data, mimetype='application/x-ndjson')
+    response.headers['X-Next-Offset'] = str(offset)
+    return response
+
+@app.route('/batch/<batch_id>/files/<path:name>', methods=['GET'])
+def download_batch_file(batch_id, name):
+    if batch_jobs.get(batch_id) is not None:
+        try:
+            path = batch_jobs.output_path(batch_id, name)
+        except ValueError:
+            path = None
+        if path is not None and os.path.isfile(path):
+            return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+    return jsonify({"status": "error", "message": "Unknown file"}), 404
 
 @app.route('/clean_document', methods=['POST'])
 def clean_document():
-    return jsonify({"status": "success", "message": "Document cleaned"})
+    """Queue a CE XML or PDF document for cleaning.
+
+    The document is a ?path= under MERGE_SOURCE_ROOT, an uploaded 'file'
+    form field, or the raw request body, which is received before the
+    response. Poll status_url for what was removed and the seconds spent
+    in each stage, then fetch download_url.
+    """
+    try:
+        if request.args.get('path'):
+            path = resolve_source(request.args['path'])
+            if not os.path.isfile(path):
+                return jsonify({"status": "error", "message": "File not found"}), 404
+            job = clean_jobs.submit(path=path)
+        elif request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({"status": "error", "message": "No file uploaded"}), 400
+            job = clean_jobs.submit(stream=upload.stream)
+        else:
+            job = clean_jobs.submit(stream=request.stream)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except JobQueueFull as e:
+        response = jsonify({"status": "busy", "message": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    return jsonify({
+        "status": "queued",
+        "message": "Document queued for cleaning",
+        "document_id": job.job_id,
+        "status_url": f"/clean_document/{job.job_id}/status",
+        "download_url": f"/clean_document/{job.job_id}",
+    }), 202
+
+@app.route('/clean_document/<document_id>/status', methods=['GET'])
+def clean_status(document_id):
+    status = clean_jobs.get(document_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown document"}), 404
+    return jsonify(status)
+
+@app.route('/clean_document/<document_id>', methods=['GET'])
+def download_cleaned(document_id):
+    status = clean_jobs.get(document_id)
+    path = clean_jobs.output_path(document_id) if status is not None else None
+    if status is not None and status['status'] != 'done':
+        return jsonify({"status": status['status'], "message": "Document is not cleaned yet",
+                        "error": status.get('error')}), 409
+    if path is None:
+        return jsonify({"status": "error", "message": "Unknown document"}), 404
+    ext = os.path.splitext(path)[1]
+    return send_file(path, mimetype='application/pdf' if ext == '.pdf' else 'application/xml',
+                     as_attachment=True, download_name=f"cleaned{ext}")
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this worker process, or of all of them with METRICS_DIR"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def create_app():
+    """Return the app with its shared state warmed, for gunicorn --preload.
+
+    Called once in the gunicorn master (see gunicorn.conf.py): the PDF
+    libraries are imported, the page template compiled and the result
+    cache swept before the workers fork, so they share all of it
+    copy-on-write instead of each paying for it on its first request.
+    Nothing here starts a thread or a pool; workers create those on first
+    use.
+    """
+    # Loads PyPDF2, which the routes otherwise import on first use
+    import pdf_writer
+
+    os.makedirs(app.config['MERGE_OUTPUT_DIR'], exist_ok=True)
+    app.jinja_env.get_template('index.html')
+    result_cache.evict()
+    # Keep what is loaded now out of the collector, whose scans would
+    # otherwise touch, and so copy, the shared pages in every worker
+    gc.freeze()
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    create_app().run(host='0.0.0.0', port=5000)
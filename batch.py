@@ -0,0 +1,170 @@
+"""Run many document operations from one manifest over a shared worker pool.
+
+A manifest is a JSON list (or an object with a "documents" list, or NDJSON)
+of items such as:
+
+    {"id": "a1", "operation": "find_xml_tags", "path": "a1/main.xml", "locations": true}
+    {"id": "b7", "operation": "export_pdf", "folder": "b7", "output": "b7.pdf"}
+    {"id": "c2", "operation": "clean_document", "path": "c2/main.xml"}
+
+Results are produced as NDJSON lines in completion order, one per item.
+
+Usage:
+    python batch.py MANIFEST [--workers N] [--processes] [--root DIR] [--output-dir DIR]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from document_cleaner import clean_path
+from merge_engine import list_pdf_files, merge_files
+from xml_scanner import scan_path
+
+# Items submitted ahead of completed ones, per worker
+IN_FLIGHT_PER_WORKER = 4
+
+
+def resolve_under(root, path):
+    """Resolve path against root, refusing anything outside it"""
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if full != root and not full.startswith(root + os.sep):
+        raise ValueError(f"{path} is outside the source root")
+    return full
+
+
+def op_find_xml_tags(item, root, output_dir):
+    return scan_path(resolve_under(root, item['path']), bool(item.get('locations')), item.get('tags'))
+
+
+def export_sources(item, root):
+    """Resolve the PDFs an export item names: its "files" list, else those in its "folder".
+
+    An item naming neither is refused rather than taken to mean all of root.
+    """
+    files = item.get('files')
+    if files is not None:
+        if not isinstance(files, list) or not all(isinstance(p, str) for p in files):
+            raise ValueError('"files" must be a list of paths')
+        return [resolve_under(root, p) for p in files]
+    folder = item.get('folder')
+    if not isinstance(folder, str) or not folder:
+        raise ValueError('Give the "files" or the "folder" to merge')
+    return list_pdf_files(resolve_under(root, folder), bool(item.get('include_subfolders')),
+                          item.get('sort_by', 'name'))
+
+
+def op_export_pdf(item, root, output_dir):
+    pdf_files = export_sources(item, root)
+    if not pdf_files:
+        raise ValueError("No PDF files to merge")
+    output_path = resolve_under(output_dir, item.get('output') or f"{item.get('id', 'merged')}.pdf")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    result = merge_files(pdf_files, output_path, outline=[] if item.get('outline', True) else None,
+                         incremental=bool(item.get('incremental')), dedup=bool(item.get('dedup')))
+    return {
+        'output': os.path.relpath(output_path, output_dir),
+        'pages': result.pages,
+        'files': result.files,
+        'bytes_saved': result.bytes_saved,
+        'errors': [{'file': os.path.basename(p), 'error': e} for p, e in result.errors],
+    }
+
+
+def op_clean_document(item, root, output_dir):
+    path = resolve_under(root, item['path'])
+    name = item.get('output') or item.get('id') or os.path.splitext(os.path.basename(path))[0]
+    output_stem = resolve_under(output_dir, os.path.splitext(name)[0])
+    os.makedirs(os.path.dirname(output_stem), exist_ok=True)
+    result = clean_path(path, output_stem)
+    result['output'] = os.path.relpath(result['output'], output_dir)
+    return result
+
+
+OPERATIONS = {
+    'clean_document': op_clean_document,
+    'export_pdf': op_export_pdf,
+    'find_xml_tags': op_find_xml_tags,
+}
+
+
+def run_item(item, root, output_dir):
+    """Run one manifest item and return its result record; never raises"""
+    start = time.perf_counter()
+    record = {'id': item.get('id'), 'operation': item.get('operation')}
+    try:
+        operation = OPERATIONS.get(item.get('operation'))
+        if operation is None:
+            raise ValueError(f"Unknown operation {item.get('operation')!r}")
+        record['result'] = operation(item, root, output_dir)
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e) or e.__class__.__name__
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def parse_manifest(text):
+    """Parse a JSON or NDJSON manifest into a list of item dicts"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data['documents'] if 'documents' in data else [data]
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise ValueError("Manifest must be a list of objects")
+    return data
+
+
+def run_batch(items, executor, root, output_dir, workers):
+    """Yield a result record per item as each completes.
+
+    At most workers * IN_FLIGHT_PER_WORKER items are queued on executor at
+    a time, so a large manifest does not flood a shared pool.
+    """
+    items = iter(items)
+    pending = set()
+    limit = max(1, workers * IN_FLIGHT_PER_WORKER)
+    while True:
+        for item in items:
+            pending.add(executor.submit(run_item, item, root, output_dir))
+            if len(pending) >= limit:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a batch manifest and print NDJSON results")
+    parser.add_argument('manifest', help="manifest file, or - for stdin")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--processes', action='store_true', help="use worker processes instead of threads")
+    parser.add_argument('--root', default='.', help="directory that item paths are relative to")
+    parser.add_argument('--output-dir', default='.', help="directory that export outputs are written to")
+    args = parser.parse_args(argv)
+
+    if args.manifest == '-':
+        items = parse_manifest(sys.stdin.read())
+    else:
+        with open(args.manifest) as f:
+            items = parse_manifest(f.read())
+
+    pool = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    failed = 0
+    with pool(args.workers) as executor:
+        for record in run_batch(items, executor, args.root, args.output_dir, args.workers):
+            failed += record['status'] != 'ok'
+            print(json.dumps(record), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Batch manifests run as background jobs for the web service.
+
+A batch is accepted at once and run on a shared worker pool, as export
+jobs are, so no request is held open for the length of a manifest. Each
+batch keeps, under <output_dir>:
+
+    <batch_id>.json     its status, rewritten as items complete
+    <batch_id>.ndjson   one result record per completed item, appended
+    <batch_id>/         the files its items wrote
+
+All three are plain files, so any gunicorn worker can report on, stream
+the log of, or serve the outputs of a batch, whichever worker accepted
+it. Finished batches are deleted job_ttl seconds after they finish.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+
+from batch import resolve_under, run_batch
+from jobs import JOB_ID_RE, JobManager, JobQueueFull
+
+
+class BatchJob:
+    def __init__(self, job_id, items):
+        self.job_id = job_id
+        self.items = items
+        self.status = 'queued'
+        self.done = 0
+        self.failed = 0
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'batch_id': self.job_id,
+            'status': self.status,
+            'progress': {'done': self.done, 'failed': self.failed, 'total': len(self.items)},
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+class BatchJobManager(JobManager):
+    def __init__(self, root, output_dir, workers=4, max_batches=4, job_ttl=3600):
+        super().__init__(output_dir, job_ttl)
+        self.root = root
+        self.workers = workers
+        self.max_batches = max_batches
+
+    def submit(self, items):
+        """Queue the manifest items as a batch and return its BatchJob.
+
+        Raises JobQueueFull when max_batches batches are already queued or
+        running in this process.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.prune()
+        batch_id = uuid.uuid4().hex
+        job = BatchJob(batch_id, items)
+        with self._lock:
+            active = self._active()
+            if active >= self.max_batches:
+                raise JobQueueFull(f"{active} batches already queued")
+            self.jobs[batch_id] = job
+        os.makedirs(self._path(batch_id))
+        open(self._path(batch_id, 'ndjson'), 'w').close()
+        self.write_status(job, force=True)
+        self.pool('batch-runner', self.max_batches).submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.status = 'running'
+        self.write_status(job, force=True)
+        output_dir = self._path(job.job_id)
+        items = self.pool('batch', self.workers)
+        try:
+            with open(self._path(job.job_id, 'ndjson'), 'a') as log:
+                for record in run_batch(job.items, items, self.root, output_dir, self.workers):
+                    output = (record.get('result') or {}).get('output') if record['status'] == 'ok' else None
+                    if output:
+                        record['download_url'] = f"/batch/{job.job_id}/files/{output}"
+                    log.write(json.dumps(record) + '\n')
+                    log.flush()
+                    job.done += 1
+                    job.failed += record['status'] != 'ok'
+                    self.write_status(job)
+            job.status = 'done'
+        except Exception:
+            job.status = 'failed'
+        job.finished = time.time()
+        self.write_status(job, force=True)
+
+    def read_log(self, batch_id, offset=0):
+        """Return (complete NDJSON lines from byte offset, offset to ask for next)"""
+        with open(self._path(batch_id, 'ndjson'), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # A record being appended right now is left for the next poll
+        end = data.rfind(b'\n') + 1
+        return data[:end], offset + end
+
+    def output_path(self, batch_id, name):
+        """Resolve an output file of batch_id, refusing anything outside its folder"""
+        return resolve_under(self._path(batch_id), name)
+
+    def prune(self):
+        """Delete batches, from any worker, that finished more than job_ttl ago"""
+        self.forget_expired()
+        cutoff = time.time() - self.job_ttl
+        try:
+            names = os.listdir(self.output_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            batch_id, ext = os.path.splitext(name)
+            if ext != '.json' or not JOB_ID_RE.match(batch_id) or batch_id in self.jobs:
+                continue
+            status = self.get(batch_id)
+            if status is None or status.get('finished') is None or status['finished'] >= cutoff:
+                continue
+            shutil.rmtree(self._path(batch_id), ignore_errors=True)
+            for ext in ('ndjson', 'json'):
+                try:
+                    os.remove(self._path(batch_id, ext))
+                except OSError:
+                    pass
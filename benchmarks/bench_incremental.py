@@ -0,0 +1,57 @@
+"""Time a full merge against an incremental re-merge after one chapter changes.
+
+Usage:
+    python benchmarks/bench_incremental.py [--files 1000] [--corpus DIR]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import make_corpus, make_pdf
+from merge_engine import list_pdf_files, merge_files
+
+
+def timed_merge(pdf_files, output_path, incremental):
+    start = time.perf_counter()
+    result = merge_files(pdf_files, output_path, incremental=incremental)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--max-pages', type=int, default=8)
+    parser.add_argument('--image-bytes', type=int, default=16384)
+    parser.add_argument('--corpus', help="reuse or create the corpus in this folder")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = args.corpus or os.path.join(tmp, 'corpus')
+        if not list_pdf_files(corpus):
+            print(f"Generating {args.files} PDFs in {corpus}...", file=sys.stderr)
+            make_corpus(corpus, files=args.files, max_pages=args.max_pages, image_bytes=args.image_bytes)
+        pdf_files = list_pdf_files(corpus)
+        output_path = os.path.join(tmp, 'book.pdf')
+
+        full, result = timed_merge(pdf_files, output_path, incremental=False)
+        print(f"full merge:          {full:8.2f}s  {result.pages} pages")
+
+        first, result = timed_merge(pdf_files, output_path, incremental=True)
+        print(f"first incremental:   {first:8.2f}s  {result.pages} pages (writes the manifest)")
+
+        changed = pdf_files[len(pdf_files) // 2]
+        make_pdf(changed, 3, args.image_bytes, random.Random(1))
+        again, result = timed_merge(pdf_files, output_path, incremental=True)
+        print(f"one file changed:    {again:8.2f}s  {result.pages} pages, {result.reused} files reused")
+
+        print(f"speedup vs full merge: {full / again:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
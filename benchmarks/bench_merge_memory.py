@@ -0,0 +1,103 @@
+"""Compare peak memory and throughput of the streaming merge engine against
+PyPDF2's PdfMerger on a synthetic corpus.
+
+Each merge runs in its own interpreter so peak RSS is measured in isolation.
+
+Usage:
+    python benchmarks/bench_merge_memory.py [--files 1000] [--corpus DIR]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import make_corpus
+from merge_engine import list_pdf_files, merge_files
+
+
+def merge_with_pdfmerger(pdf_files, output_path):
+    from PyPDF2 import PdfMerger
+
+    merger = PdfMerger()
+    merger.add_metadata({
+        '/SourceFiles': "; ".join([os.path.basename(p) for p in pdf_files])
+    })
+    for pdf in pdf_files:
+        merger.append(pdf)
+    with open(output_path, 'wb') as f:
+        merger.write(f)
+    pages = len(merger.pages)
+    merger.close()
+    return pages
+
+
+def merge_with_engine(pdf_files, output_path):
+    return merge_files(pdf_files, output_path).pages
+
+
+MODES = {
+    'pdfmerger': merge_with_pdfmerger,
+    'streaming': merge_with_engine,
+}
+
+
+def run_mode(mode, corpus, output_path):
+    pdf_files = list_pdf_files(corpus)
+    start = time.perf_counter()
+    pages = MODES[mode](pdf_files, output_path)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'mode': mode,
+        'files': len(pdf_files),
+        'pages': pages,
+        'seconds': elapsed,
+        'peak_rss_kb': peak_kb,
+        'output_bytes': os.path.getsize(output_path),
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--max-pages', type=int, default=8)
+    parser.add_argument('--image-bytes', type=int, default=16384)
+    parser.add_argument('--corpus', help="reuse or create the corpus in this folder")
+    parser.add_argument('--mode', choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        run_mode(args.mode, args.corpus, args.output)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = args.corpus or os.path.join(tmp, 'corpus')
+        if not list_pdf_files(corpus):
+            print(f"Generating {args.files} PDFs in {corpus}...", file=sys.stderr)
+            make_corpus(corpus, files=args.files, max_pages=args.max_pages, image_bytes=args.image_bytes)
+
+        input_bytes = sum(os.path.getsize(p) for p in list_pdf_files(corpus))
+        print(f"corpus: {len(list_pdf_files(corpus))} files, {input_bytes / 2**20:.1f} MiB")
+        print(f"{'mode':<10} {'pages':>7} {'seconds':>9} {'pages/s':>9} {'peak RSS MiB':>13}")
+        for mode in ('pdfmerger', 'streaming'):
+            output_path = os.path.join(tmp, f'{mode}.pdf')
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', mode,
+                 '--corpus', corpus, '--output', output_path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            stats = json.loads(out.strip().splitlines()[-1])
+            print(f"{mode:<10} {stats['pages']:>7} {stats['seconds']:>9.2f} "
+                  f"{stats['pages'] / stats['seconds']:>9.0f} {stats['peak_rss_kb'] / 1024:>13.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
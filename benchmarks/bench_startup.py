@@ -0,0 +1,138 @@
+"""Time cold starts: module imports, app warm-up and first requests.
+
+Every scenario runs in fresh interpreters, so nothing is cached between
+runs but the filesystem. Reported are the median process wall time
+(interpreter start included) and the medians of the times each run
+measures itself:
+
+    core      import merge_engine, then merge one PDF
+    gui       import the merger tool's module without opening a window
+    web       import app, then the first page, PDF and metrics requests
+    preload   as web, with create_app() run first as gunicorn --preload does
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--scenarios core,gui,web,preload]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('core', 'gui', 'web', 'preload')
+
+
+def timed(stats, name, function):
+    start = time.perf_counter()
+    value = function()
+    stats[name] = time.perf_counter() - start
+    return value
+
+
+def run_core(stats, pdf, tmp):
+    merge_engine = timed(stats, 'import', lambda: importlib.import_module('merge_engine'))
+    stats['pdf_library_loaded'] = 'PyPDF2' in sys.modules
+    timed(stats, 'first_merge', lambda: merge_engine.merge_files([pdf], os.path.join(tmp, 'merged.pdf')))
+
+
+def run_gui(stats, pdf, tmp):
+    spec = importlib.util.spec_from_file_location('pdf_merger', os.path.join(ROOT, 'pdf  merger.py'))
+    timed(stats, 'import', lambda: spec.loader.exec_module(importlib.util.module_from_spec(spec)))
+    stats['pdf_library_loaded'] = 'PyPDF2' in sys.modules
+
+
+def clean(client, path):
+    """Clean a document through the web app and return the finished job's status response"""
+    response = client.post(path)
+    if response.status_code != 202:
+        return response
+    while True:
+        status = client.get(response.get_json()['status_url'])
+        if status.get_json()['status'] not in ('queued', 'running'):
+            return status
+        time.sleep(0.005)
+
+
+def run_web(stats, pdf, tmp, preload=False):
+    os.environ['MERGE_SOURCE_ROOT'] = os.path.dirname(pdf)
+    os.environ['MERGE_OUTPUT_DIR'] = os.path.join(tmp, 'exports')
+    app = timed(stats, 'import', lambda: importlib.import_module('app'))
+    stats['pdf_library_loaded'] = 'PyPDF2' in sys.modules
+    if preload:
+        timed(stats, 'create_app', app.create_app)
+    client = app.app.test_client()
+    path = f"/clean_document?path={os.path.basename(pdf)}"
+    for name, request in (('first_page', lambda: client.get('/')),
+                          ('first_pdf_request', lambda: clean(client, path)),
+                          ('second_pdf_request', lambda: clean(client, path)),
+                          ('first_metrics', lambda: client.get('/metrics'))):
+        response = timed(stats, name, request)
+        if response.status_code != 200 or (response.is_json and response.get_json().get('status') == 'failed'):
+            raise RuntimeError(f"{name} returned {response.status_code}")
+
+
+def run_child(scenario, pdf):
+    stats = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if scenario == 'core':
+            run_core(stats, pdf, tmp)
+        elif scenario == 'gui':
+            run_gui(stats, pdf, tmp)
+        else:
+            run_web(stats, pdf, tmp, preload=scenario == 'preload')
+    print(json.dumps(stats))
+
+
+def run_scenario(scenario, pdf, repeat):
+    """Return ({metric: median seconds}, flags) over repeat fresh interpreters"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario, '--pdf', pdf],
+                             check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        stats = json.loads(out.strip().splitlines()[-1])
+        stats['process'] = time.perf_counter() - start
+        runs.append(stats)
+    metrics = {name: statistics.median(run[name] for run in runs)
+               for name, value in runs[0].items() if not isinstance(value, bool)}
+    return metrics, runs[0].get('pdf_library_loaded')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--pdf', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.pdf)
+        return 0
+
+    from benchmarks.corpus import make_corpus
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = make_corpus(os.path.join(tmp, 'corpus'), files=1, min_pages=4, max_pages=4)[0]
+        for scenario in args.scenarios.split(','):
+            try:
+                metrics, loaded = run_scenario(scenario, pdf, args.repeat)
+            except subprocess.CalledProcessError as e:
+                print(f"{scenario}: failed\n{e.stderr.strip()}", file=sys.stderr)
+                continue
+            print(f"{scenario} (PyPDF2 {'loaded' if loaded else 'not loaded'} on import)")
+            for name, seconds in metrics.items():
+                print(f"  {name:<20} {seconds * 1000:9.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
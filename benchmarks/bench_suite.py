@@ -0,0 +1,311 @@
+"""Benchmark folder scanning, merging, bookmark matching and the HTTP routes.
+
+A deterministic corpus is generated for the chosen profile (file count,
+page counts, outline depth, shared resources) and each stage runs in its
+own interpreter so its peak RSS is measured in isolation. Results are
+compared with a stored baseline; a stage slower than the baseline by more
+than the tolerance fails the run.
+
+benchmarks/baselines.json holds the baseline of each profile, with the
+machine that produced it under "machine"; timings only compare on
+similar hardware, so regenerate it with --save-baseline where the suite
+is run regularly. The committed small baseline is the slowest of three
+runs on a single-CPU Linux x86_64 machine with Python 3.11.
+
+Usage:
+    python benchmarks/bench_suite.py [--profile small|medium|large] [--corpus DIR]
+                                     [--baseline FILE] [--save-baseline] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import make_corpus, make_sequence_pdf, make_xml
+
+PROFILES = {
+    'small': {'files': 100, 'max_pages': 4, 'outline_depth': 2, 'shared_image_bytes': 32768, 'paragraphs': 2000},
+    'medium': {'files': 1000, 'max_pages': 8, 'outline_depth': 3, 'shared_image_bytes': 65536, 'paragraphs': 20000},
+    'large': {'files': 10000, 'max_pages': 8, 'outline_depth': 3, 'shared_image_bytes': 65536,
+              'paragraphs': 200000},
+}
+
+STAGES = ('scan', 'bookmarks', 'merge', 'merge_dedup', 'http')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def prepare_corpus(corpus, profile):
+    """Generate the corpus for profile in corpus unless it is already there"""
+    stamp_path = os.path.join(corpus, 'profile.json')
+    params = PROFILES[profile]
+    try:
+        with open(stamp_path) as f:
+            if json.load(f) == params:
+                return
+    except (OSError, ValueError):
+        pass
+    print(f"Generating the {profile} corpus in {corpus}...", file=sys.stderr)
+    pdf_files = make_corpus(os.path.join(corpus, 'chapters'), files=params['files'], max_pages=params['max_pages'],
+                            outline_depth=params['outline_depth'], shared_image_bytes=params['shared_image_bytes'])
+    make_sequence_pdf(os.path.join(corpus, 'sequence.pdf'), pdf_files, missing=max(1, len(pdf_files) // 100))
+    make_xml(os.path.join(corpus, 'article.xml'), params['paragraphs'])
+    with open(stamp_path, 'w') as f:
+        json.dump(params, f)
+
+
+def bench_scan(corpus, tmp):
+    from merge_engine import scan_pdf_files, sort_pdf_entries
+
+    start = time.perf_counter()
+    entries = scan_pdf_files(os.path.join(corpus, 'chapters'))
+    scanned = time.perf_counter()
+    sort_pdf_entries(entries, 'date')
+    return {'files': len(entries), 'seconds': time.perf_counter() - start,
+            'stages': {'scan': scanned - start, 'sort': time.perf_counter() - scanned}}
+
+
+def bench_bookmarks(corpus, tmp):
+    from bookmark_matcher import read_bookmark_sequence
+    from merge_engine import list_pdf_files
+
+    pdf_files = list_pdf_files(os.path.join(corpus, 'chapters'))
+    start = time.perf_counter()
+    roots, matches = read_bookmark_sequence(os.path.join(corpus, 'sequence.pdf'), pdf_files)
+    return {'bookmarks': len(matches), 'matched': sum(1 for _, path, _ in matches if path is not None),
+            'seconds': time.perf_counter() - start}
+
+
+def run_merge(corpus, tmp, **options):
+    from merge_engine import list_pdf_files, merge_files
+
+    pdf_files = list_pdf_files(os.path.join(corpus, 'chapters'))
+    output_path = os.path.join(tmp, 'merged.pdf')
+    start = time.perf_counter()
+    result = merge_files(pdf_files, output_path, outline=[], **options)
+    return {'pages': result.pages, 'seconds': time.perf_counter() - start,
+            'output_bytes': os.path.getsize(output_path), 'bytes_saved': result.bytes_saved}
+
+
+def bench_merge(corpus, tmp):
+    return run_merge(corpus, tmp)
+
+
+def bench_merge_dedup(corpus, tmp):
+    return run_merge(corpus, tmp, dedup=True)
+
+
+def load(url, make_request, concurrency, requests):
+    """Issue requests requests from concurrency threads; return latencies and wall time"""
+    import http.client
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def client():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            method, path, body, headers = make_request()
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+                status = str(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status not in (200, 202, 304):
+                    errors.append(status)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def bench_http(corpus, tmp, concurrency=8, requests=200):
+    os.environ['MERGE_SOURCE_ROOT'] = corpus
+    os.environ['MERGE_OUTPUT_DIR'] = os.path.join(tmp, 'exports')
+    # Every cleaning request is accepted; clean_xml times accepting them
+    os.environ['MERGE_QUEUE_DEPTH'] = str(requests)
+    from werkzeug.serving import make_server
+
+    from app import app, clean_jobs
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    client = app.test_client()
+
+    # Merge once so the repeated export is answered from the result cache
+    export = json.dumps({'folder': 'chapters', 'filename': 'book.pdf'})
+    job = client.post('/export_pdf', data=export, content_type='application/json').get_json()
+    while client.get(f"/jobs/{job['job_id']}").get_json()['status'] in ('queued', 'running'):
+        time.sleep(0.05)
+
+    with open(os.path.join(corpus, 'article.xml'), 'rb') as f:
+        article = f.read()
+    json_headers = {'Content-Type': 'application/json'}
+    xml_headers = {'Content-Type': 'application/xml'}
+    scenarios = {
+        'export_cached': lambda: ('POST', '/export_pdf', export, json_headers),
+        'job_status': lambda: ('GET', f"/jobs/{job['job_id']}", None, {}),
+        'find_xml_tags': lambda: ('POST', '/find_xml_tags', article, xml_headers),
+        'clean_xml': lambda: ('POST', '/clean_document', article, xml_headers),
+    }
+    results = {}
+    seconds = 0.0
+    try:
+        for name, make_request in scenarios.items():
+            latencies, errors, wall = load(url, make_request, concurrency, requests)
+            seconds += wall
+            results[name] = {
+                'requests': len(latencies),
+                'errors': len(errors),
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'mean_ms': statistics.fmean(latencies) * 1000,
+                'rps': len(latencies) / wall,
+            }
+    finally:
+        server.shutdown()
+        # Accepted documents are still being cleaned in the background
+        while clean_jobs.count('queued') or clean_jobs.count('running'):
+            time.sleep(0.05)
+    return {'seconds': seconds, 'concurrency': concurrency, 'endpoints': results}
+
+
+BENCHMARKS = {
+    'scan': bench_scan,
+    'bookmarks': bench_bookmarks,
+    'merge': bench_merge,
+    'merge_dedup': bench_merge_dedup,
+    'http': bench_http,
+}
+
+
+def run_stage(stage, corpus):
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = BENCHMARKS[stage](corpus, tmp)
+    stats['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(stats))
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def compare(stage, stats, baseline, tolerance):
+    """Return (metric, current, baseline) for every metric slower than baseline allows.
+
+    Each metric also has an absolute slack, so timer noise on very fast
+    stages is not reported.
+    """
+    if not baseline:
+        return []
+    checks = [('seconds', stats['seconds'], baseline.get('seconds'), 0.01),
+              ('peak_rss_kb', stats['peak_rss_kb'], baseline.get('peak_rss_kb'), 1024)]
+    for name, endpoint in stats.get('endpoints', {}).items():
+        old = baseline.get('endpoints', {}).get(name, {})
+        checks.append((f"{name}.p99_ms", endpoint['p99_ms'], old.get('p99_ms'), 1.0))
+    return [(metric, current, old) for metric, current, old, slack in checks
+            if old and current > old * (1 + tolerance) + slack]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated subset of " + ", ".join(STAGES))
+    parser.add_argument('--corpus', help="reuse or create the corpus in this folder")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    parser.add_argument('--stage', choices=sorted(BENCHMARKS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.stage:
+        run_stage(args.stage, args.corpus)
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except (OSError, ValueError):
+        baselines = {}
+    baseline = baselines.get(args.profile, {})
+    if baseline.get('machine') and baseline['machine'] != machine_info():
+        print(f"Note: the baseline was produced on {baseline['machine']}", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.abspath(args.corpus or os.path.join(tmp, 'corpus'))
+        prepare_corpus(corpus, args.profile)
+
+        results = {}
+        regressions = []
+        print(f"{'stage':<12} {'seconds':>9} {'baseline':>9} {'peak RSS MiB':>13}")
+        for stage in args.stages.split(','):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--stage', stage, '--corpus', corpus],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            stats = results[stage] = json.loads(out.strip().splitlines()[-1])
+            old = baseline.get(stage, {}).get('seconds')
+            old = f"{old:.3f}" if old is not None else '-'
+            print(f"{stage:<12} {stats['seconds']:>9.3f} {old:>9} {stats['peak_rss_kb'] / 1024:>13.1f}")
+            for name, endpoint in stats.get('endpoints', {}).items():
+                print(f"  {name:<16} p50 {endpoint['p50_ms']:8.2f} ms  p99 {endpoint['p99_ms']:8.2f} ms  "
+                      f"{endpoint['rps']:8.1f} req/s  {endpoint['errors']} errors")
+            regressions += [(stage,) + r for r in compare(stage, stats, baseline.get(stage), args.tolerance)]
+
+    if args.save_baseline:
+        baselines[args.profile] = dict(baseline, machine=machine_info(), **results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baseline for {args.profile} to {args.baseline}")
+        return 0
+    for stage, metric, current, old in regressions:
+        print(f"Regression: {stage} {metric} {current:.3f} vs baseline {old:.3f}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
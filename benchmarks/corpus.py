@@ -0,0 +1,143 @@
+"""Deterministic synthetic PDF corpora for the benchmarks."""
+import os
+import random
+
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+# Seed of the "logo" every file embeds when shared resources are requested
+SHARED_SEED = 1234
+
+
+def make_image(writer, data):
+    image = DecodedStreamObject()
+    image.set_data(data)
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(len(data) // 3 or 1),
+        NameObject("/Height"): NumberObject(1),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return writer._add_object(image)
+
+
+def add_outline(writer, title, page_number, depth, parent=None):
+    """Add a bookmark for page_number with a chain of depth - 1 nested children"""
+    item = writer.add_outline_item(title, page_number, parent)
+    if depth > 1:
+        add_outline(writer, f"{title}.1", page_number, depth - 1, item)
+    return item
+
+
+def make_pdf(path, pages, image_bytes, rng, outline_depth=0, shared_image_bytes=0, named_dests=False):
+    """Write a PDF of pages pages, each with random image data.
+
+    outline_depth adds a bookmark per page nested that many levels deep.
+    shared_image_bytes adds a logo that is byte-identical in every file,
+    as template fonts and images are in chapters from one template.
+    named_dests adds a named destination per page, plus a "cover" one on
+    the first page that every file has, as chapters from one template do.
+    """
+    writer = PdfWriter()
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    font_ref = writer._add_object(font)
+    logo_ref = None
+    if shared_image_bytes:
+        logo_ref = make_image(writer, random.Random(SHARED_SEED).randbytes(shared_image_bytes))
+
+    title = os.path.splitext(os.path.basename(path))[0]
+    for page_number in range(pages):
+        page = PageObject.create_blank_page(width=612, height=792)
+
+        xobjects = DictionaryObject({NameObject("/Im1"): make_image(writer, rng.randbytes(image_bytes))})
+        draw_logo = ""
+        if logo_ref is not None:
+            xobjects[NameObject("/Logo")] = logo_ref
+            draw_logo = "q 72 0 0 36 72 72 cm /Logo Do Q\n"
+
+        content = DecodedStreamObject()
+        content.set_data(
+            f"BT /F1 18 Tf 72 720 Td ({title} page {page_number + 1}) Tj ET\n"
+            f"q 468 0 0 72 72 600 cm /Im1 Do Q\n{draw_logo}".encode()
+        )
+
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font_ref}),
+            NameObject("/XObject"): xobjects,
+        })
+        page[NameObject("/Contents")] = writer._add_object(content)
+        writer.add_page(page)
+
+    for page_number in range(pages if outline_depth else 0):
+        add_outline(writer, f"{title} section {page_number + 1}", page_number, outline_depth)
+    if named_dests:
+        writer.add_named_destination("cover", 0)
+        for page_number in range(pages):
+            writer.add_named_destination(f"{title}-p{page_number + 1}", page_number)
+
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def make_corpus(folder, files=1000, min_pages=1, max_pages=8, image_bytes=16384, seed=0,
+                outline_depth=0, shared_image_bytes=0, named_dests=False):
+    """Write files synthetic chapter PDFs to folder and return their paths"""
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        path = os.path.join(folder, f"ch{i:05d}.pdf")
+        make_pdf(path, rng.randint(min_pages, max_pages), image_bytes, rng, outline_depth, shared_image_bytes,
+                 named_dests)
+        paths.append(path)
+    return paths
+
+
+def chapter_title(path, rng):
+    """A bookmark title for a chapter file, written the ways editors write them"""
+    number = int(os.path.splitext(os.path.basename(path))[0][2:])
+    return rng.choice([f"ch{number:05d}", f"Chapter {number}", f"Ch. {number}", f"CHAPTER {number:03d}"])
+
+
+def make_sequence_pdf(path, pdf_files, seed=0, missing=0):
+    """Write a one-page PDF whose bookmarks list pdf_files in a shuffled order.
+
+    missing adds that many bookmarks that match no file.
+    """
+    rng = random.Random(seed)
+    titles = [chapter_title(p, rng) for p in pdf_files]
+    titles += [f"Appendix {i + 1}" for i in range(missing)]
+    rng.shuffle(titles)
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    for title in titles:
+        writer.add_outline_item(title, 0)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return titles
+
+
+def make_xml(path, paragraphs=1000, empty_fraction=0.1, seed=0):
+    """Write a CE XML document with paragraphs ce:para elements, some of them empty"""
+    rng = random.Random(seed)
+    words = ["ligand", "protein", "binding", "assay", "cohort", "signal", "model", "dose", "trial", "cell"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<ce:article xmlns:ce="http://www.elsevier.com/xml/common/dtd">\n<ce:sections>\n')
+        for i in range(paragraphs):
+            if i % 50 == 0:
+                f.write(f'<ce:section id="s{i // 50}"><ce:section-title>Section {i // 50}</ce:section-title>\n')
+            if rng.random() < empty_fraction:
+                f.write('<ce:para>  </ce:para>\n')
+            else:
+                text = " ".join(rng.choice(words) for _ in range(rng.randint(20, 80)))
+                f.write(f'<ce:para id="p{i}">{text} <ce:italic>et al.</ce:italic> &amp; more.</ce:para>\n')
+            if i % 50 == 49 or i == paragraphs - 1:
+                f.write('</ce:section>\n')
+        f.write('</ce:sections>\n</ce:article>\n')
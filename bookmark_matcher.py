@@ -0,0 +1,159 @@
+"""Fuzzy matching of bookmark titles to PDF file names.
+
+Each file name is normalized once (casefolded, punctuation removed, numbers
+stripped of leading zeros, common words abbreviated) and indexed by
+character trigram. A title is scored only against the files that share its
+more selective trigrams, so matching N bookmarks costs roughly
+O(N x candidates) instead of O(N x files).
+"""
+import os
+import re
+from collections import Counter, defaultdict
+
+from lazy_reader import open_mapped
+from merge_engine import outline_tree
+
+# Scores below this are not treated as matches
+MATCH_THRESHOLD = 0.5
+
+# Fuzzy scoring only looks at this many of the best trigram candidates
+MAX_CANDIDATES = 50
+
+ABBREVIATIONS = {
+    'chapter': 'ch',
+    'chap': 'ch',
+    'section': 'sec',
+    'appendix': 'app',
+    'part': 'pt',
+    'figure': 'fig',
+    'volume': 'vol',
+}
+
+TOKEN_RE = re.compile(r'\d+|[^\W\d_]+')
+
+
+def normalize(text):
+    """Return the normalized tokens of a title or file name"""
+    text = text.casefold()
+    if text.endswith('.pdf'):
+        text = text[:-4]
+    tokens = []
+    for token in TOKEN_RE.findall(text):
+        if token.isdigit():
+            token = token.lstrip('0') or '0'
+        else:
+            token = ABBREVIATIONS.get(token, token)
+        tokens.append(token)
+    return tokens
+
+
+def trigrams(tokens):
+    padded = f" {' '.join(tokens)} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class BookmarkMatcher:
+    def __init__(self, pdf_files):
+        self.pdf_files = list(pdf_files)
+        self.exact = {}
+        self.grams = []
+        self.numbers = []
+        self.index = defaultdict(list)
+
+        for file_id, path in enumerate(self.pdf_files):
+            name = os.path.basename(path)
+            self.exact.setdefault(name, path)
+            tokens = normalize(name)
+            grams = trigrams(tokens)
+            self.grams.append(grams)
+            self.numbers.append({t for t in tokens if t.isdigit()})
+            for gram in grams:
+                self.index[gram].append(file_id)
+
+        self.max_postings = max(MAX_CANDIDATES, len(self.pdf_files) // 50)
+
+    def exact_match(self, title):
+        """Match title the way the file list always has: basename with or without .pdf"""
+        clean_title = os.path.splitext(title)[0]
+        for ext in ['', '.pdf', '.PDF']:
+            path = self.exact.get(clean_title + ext)
+            if path is not None:
+                return path
+        return None
+
+    def match(self, title, limit=5):
+        """Return up to limit (path, score) candidates for title, best first"""
+        exact = self.exact_match(title)
+        if exact is not None:
+            return [(exact, 1.0)]
+
+        tokens = normalize(title)
+        if not tokens:
+            return []
+        grams = trigrams(tokens)
+        numbers = {t for t in tokens if t.isdigit()}
+
+        # Very common trigrams say little about a title; only fall back to
+        # them when nothing more selective is shared
+        postings = sorted((self.index[g] for g in grams if g in self.index), key=len)
+        selective = [p for p in postings if len(p) <= self.max_postings] or postings[:3]
+        shared = Counter()
+        for posting in selective:
+            shared.update(posting)
+
+        scored = []
+        for file_id, _ in shared.most_common(MAX_CANDIDATES):
+            file_grams = self.grams[file_id]
+            score = 2 * len(grams & file_grams) / (len(grams) + len(file_grams))
+            file_numbers = self.numbers[file_id]
+            if numbers and file_numbers and numbers != file_numbers:
+                score *= 0.7 if numbers & file_numbers else 0.3
+            scored.append((self.pdf_files[file_id], score))
+
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+    def match_titles(self, titles, threshold=MATCH_THRESHOLD):
+        """Match each title to a file, preferring files not already claimed.
+
+        Returns a list of (title, path, score) with path None when nothing
+        scored at least threshold.
+        """
+        used = set()
+        matches = []
+        for title in titles:
+            best = None
+            exact = self.exact_match(title)
+            if exact is not None:
+                best = (exact, 1.0)
+            else:
+                for path, score in self.match(title):
+                    if score < threshold:
+                        break
+                    if path not in used:
+                        best = (path, score)
+                        break
+            if best is None:
+                matches.append((title, None, 0.0))
+            else:
+                used.add(best[0])
+                matches.append((title, best[0], best[1]))
+        return matches
+
+
+def read_bookmark_sequence(pdf_path, pdf_files, threshold=MATCH_THRESHOLD):
+    """Match the bookmarks of pdf_path against pdf_files.
+
+    Returns (roots, matches): the bookmark tree as OutlineNode roots with
+    each matched node's path set, and (title, path, score) for every
+    bookmark in document order.
+    """
+    # Only the outline items are read, never the page tree
+    with open_mapped(pdf_path) as reader:
+        roots = outline_tree(reader.outline)
+
+    nodes = [node for root in roots for node in root.walk()]
+    matches = BookmarkMatcher(pdf_files).match_titles([node.title for node in nodes], threshold)
+    for node, (_, path, _) in zip(nodes, matches):
+        node.path = path
+    return roots, matches
@@ -0,0 +1,119 @@
+"""Document cleaning run as background jobs for the web service.
+
+Cleaning a large PDF or XML document takes longer than a request should,
+so /clean_document only accepts it: a server-side path is cleaned where
+it is, and an uploaded document is first received into
+<output_dir>/<job_id>.upload. The job then writes <job_id>.pdf or
+<job_id>.xml next to its status file (see jobs.JobManager), and
+everything older than job_ttl is deleted.
+"""
+import os
+import shutil
+import time
+import uuid
+
+from document_cleaner import CHUNK_SIZE, clean_path, prune_outputs
+from instrumentation import REGISTRY
+from jobs import JobManager, JobQueueFull
+
+CLEAN_STAGE_SECONDS = REGISTRY.histogram('clean_stage_seconds', "Seconds spent per document cleaning stage",
+                                         ('stage',))
+
+
+class CleanJob:
+    def __init__(self, job_id, source, upload=False):
+        self.job_id = job_id
+        self.source = source
+        self.upload = upload
+        self.received = None
+        self.status = 'queued'
+        self.result = None
+        self.output = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return dict(self.result or {}, **{
+            'document_id': self.job_id,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+        })
+
+
+class CleanJobManager(JobManager):
+    def __init__(self, output_dir, max_workers=2, max_queued=16, job_ttl=3600):
+        super().__init__(output_dir, job_ttl)
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+
+    def submit(self, path=None, stream=None):
+        """Queue the cleaning of the file at path, or of a document read from stream.
+
+        A stream is received before this returns. Raises JobQueueFull when
+        max_queued jobs are already queued or running in this process.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.prune()
+        job_id = uuid.uuid4().hex
+        job = CleanJob(job_id, path if stream is None else self._path(job_id, 'upload'), stream is not None)
+        with self._lock:
+            active = self._active()
+            if active >= self.max_queued:
+                raise JobQueueFull(f"{active} documents already queued for cleaning")
+            self.jobs[job_id] = job
+        if stream is not None:
+            started = time.perf_counter()
+            try:
+                with open(job.source, 'wb') as f:
+                    shutil.copyfileobj(stream, f, CHUNK_SIZE)
+            except BaseException:
+                with self._lock:
+                    del self.jobs[job_id]
+                self._remove(job.source)
+                raise
+            job.received = time.perf_counter() - started
+        self.write_status(job, force=True)
+        self.pool('clean', self.max_workers).submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.status = 'running'
+        self.write_status(job, force=True)
+        try:
+            result = clean_path(job.source, self._path(job.job_id))
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e) or e.__class__.__name__
+        else:
+            job.output = result.pop('output')
+            if job.upload:
+                result['seconds']['receive'] = job.received
+            for stage, seconds in result['seconds'].items():
+                CLEAN_STAGE_SECONDS.observe(seconds, stage=stage)
+            job.result = result
+            job.status = 'done'
+        if job.upload:
+            self._remove(job.source)
+        job.finished = time.time()
+        self.write_status(job, force=True)
+
+    def output_path(self, job_id):
+        """Path of job_id's cleaned document, or None if there is none (yet)"""
+        for ext in ('pdf', 'xml'):
+            if os.path.isfile(self._path(job_id, ext)):
+                return self._path(job_id, ext)
+        return None
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """Forget jobs and delete files, from any worker, older than job_ttl"""
+        self.forget_expired()
+        prune_outputs(self.output_dir, self.job_ttl)
@@ -0,0 +1,303 @@
+"""Streaming clean-up of CE XML and PDF documents.
+
+XML is rewritten event by event with expat, dropping ce:para elements
+that hold nothing but whitespace, so memory stays constant however large
+the input is. PDFs are copied page by page through StreamingPdfWriter:
+objects that no page, bookmark or catalog entry reaches are left behind,
+and identical objects such as fonts and images embedded more than once
+are written once. Both report the time spent in each stage.
+"""
+import os
+import shutil
+import tempfile
+import time
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+from lazy_reader import open_reader
+from merge_engine import outline_tree
+
+CHUNK_SIZE = 1 << 16
+
+# Elements removed when they contain only whitespace
+EMPTY_ELEMENTS = ('ce:para',)
+
+
+class StageTimer:
+    """Accumulate wall-clock seconds per named stage"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, stage, started):
+        self.add(stage, time.perf_counter() - started)
+
+    def to_dict(self):
+        return {stage: round(seconds, 4) for stage, seconds in self.seconds.items()}
+
+
+class XmlCleaner:
+    """Rewrite an XML document without its empty elements.
+
+    Comments, processing instructions, the doctype and entity references
+    are passed through as written; the output is always UTF-8.
+    """
+
+    def __init__(self, dest, timer=None, empty_elements=EMPTY_ELEMENTS):
+        self.dest = dest
+        self.timer = timer or StageTimer()
+        self.empty_elements = set(empty_elements)
+        self.pieces = []
+        self.size = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elements = 0
+        self.removed = 0
+
+    def _write(self, text):
+        self.pieces.append(text)
+        self.size += len(text)
+        if self.size >= CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        started = self.timer.start()
+        data = ''.join(self.pieces).encode('utf-8')
+        self.dest.write(data)
+        self.bytes_out += len(data)
+        self.pieces = []
+        self.size = 0
+        self.timer.stop('write', started)
+
+    def clean(self, stream, head=b''):
+        """Rewrite the document read from stream, after the bytes in head"""
+        write = self._write
+        # An element whose start tag is not closed yet, so it can become <x/>
+        open_tag = None
+        # A candidate empty element: its start markup and the whitespace seen so far
+        held = None
+        in_cdata = False
+
+        def close_open_tag():
+            nonlocal open_tag
+            if open_tag is not None:
+                write('>')
+                open_tag = None
+
+        def release():
+            # The held element has content after all: write what was held back
+            nonlocal held, open_tag
+            if held is not None:
+                markup, text = held
+                held = None
+                close_open_tag()
+                write(markup)
+                open_tag = True
+                if text:
+                    write('>')
+                    open_tag = None
+                    write(''.join(text))
+
+        def start(tag, attrs):
+            nonlocal open_tag, held
+            self.elements += 1
+            release()
+            close_open_tag()
+            markup = '<' + tag + ''.join(
+                f" {attrs[i]}={quoteattr(attrs[i + 1])}" for i in range(0, len(attrs), 2))
+            if tag in self.empty_elements:
+                held = (markup, [])
+            else:
+                write(markup)
+                open_tag = True
+
+        def end(tag):
+            nonlocal open_tag, held
+            if held is not None:
+                held = None
+                self.removed += 1
+            elif open_tag is not None:
+                write('/>')
+                open_tag = None
+            else:
+                write('</' + tag + '>')
+
+        def characters(data):
+            if in_cdata:
+                write(data)
+            elif held is not None and not data.strip():
+                held[1].append(escape(data))
+            else:
+                release()
+                close_open_tag()
+                write(escape(data))
+
+        def start_cdata():
+            nonlocal in_cdata
+            release()
+            close_open_tag()
+            write('<![CDATA[')
+            in_cdata = True
+
+        def end_cdata():
+            nonlocal in_cdata
+            write(']]>')
+            in_cdata = False
+
+        def default(data):
+            release()
+            close_open_tag()
+            write(data)
+
+        def xml_decl(version, encoding, standalone):
+            standalone = {1: ' standalone="yes"', 0: ' standalone="no"'}.get(standalone, '')
+            write(f'<?xml version="{version or "1.0"}" encoding="UTF-8"{standalone}?>')
+
+        parser = expat.ParserCreate()
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        parser.ordered_attributes = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = characters
+        parser.StartCdataSectionHandler = start_cdata
+        parser.EndCdataSectionHandler = end_cdata
+        parser.XmlDeclHandler = xml_decl
+        # Set last: anything without a handler, such as comments and entity
+        # references, is passed to it unexpanded
+        parser.DefaultHandler = default
+        try:
+            chunk = head
+            while True:
+                if chunk:
+                    self.bytes_in += len(chunk)
+                    started = self.timer.start()
+                    parser.Parse(chunk, False)
+                    self.timer.stop('parse', started)
+                started = self.timer.start()
+                chunk = stream.read(CHUNK_SIZE)
+                self.timer.stop('read', started)
+                if not chunk:
+                    break
+            parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            raise ValueError(f"invalid XML: {e}") from None
+        self._flush()
+
+    def to_dict(self):
+        return {
+            'type': 'xml',
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'elements': self.elements,
+            'empty_elements_removed': self.removed,
+            'seconds': self.timer.to_dict(),
+        }
+
+
+def clean_pdf(f, dest, timer=None):
+    """Copy the PDF in the seekable file f to dest, keeping only what its pages and catalog use"""
+    from pdf_writer import StreamingPdfWriter
+
+    timer = timer or StageTimer()
+    started = timer.start()
+    reader = open_reader(f)
+    objects_in = sum(len(ids) for ids in reader.xref.values()) + len(reader.xref_objStm)
+    timer.stop('parse', started)
+
+    started = timer.start()
+    writer = StreamingPdfWriter(dest, dedup=True)
+    pages = writer.add_document(reader, keep_catalog=True)
+    timer.stop('copy', started)
+
+    started = timer.start()
+    try:
+        writer.outline = outline_tree(reader.outline, reader, writer.page_ids)
+    except Exception:
+        # A broken outline should not cost the document its pages
+        writer.outline = []
+    metadata = {key: value for key, value in (reader.metadata or {}).items() if isinstance(value, str)}
+    writer.close(metadata)
+    timer.stop('write', started)
+
+    return {
+        'type': 'pdf',
+        'bytes_in': f.seek(0, os.SEEK_END),
+        'bytes_out': dest.tell(),
+        'pages': pages,
+        'objects_in': objects_in,
+        'objects_out': len(writer.offsets) - 1,
+        'duplicates_removed': writer.dedup_hits,
+        'bytes_saved': writer.dedup_saved,
+        'seconds': timer.to_dict(),
+    }
+
+
+def is_pdf(head):
+    """Whether the first bytes of a document are those of a PDF"""
+    return b'%PDF-' in head[:1024]
+
+
+def clean_stream(stream, output_stem):
+    """Clean a PDF or XML document read from stream.
+
+    The output is written to output_stem plus .pdf or .xml, whose path is
+    returned in the result as 'output'. A PDF needs random access, so one
+    arriving on a stream that cannot seek is spooled to a temporary file
+    first; XML is rewritten as it arrives.
+    """
+    timer = StageTimer()
+    head = stream.read(1024)
+    pdf = is_pdf(head)
+    output_path = output_stem + ('.pdf' if pdf else '.xml')
+    part_path = output_path + '.part'
+    try:
+        with open(part_path, 'wb') as dest:
+            if not pdf:
+                cleaner = XmlCleaner(dest, timer)
+                cleaner.clean(stream, head)
+                result = cleaner.to_dict()
+            elif stream.seekable():
+                stream.seek(0)
+                result = clean_pdf(stream, dest, timer)
+            else:
+                with tempfile.TemporaryFile() as spool:
+                    started = timer.start()
+                    spool.write(head)
+                    shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+                    timer.stop('receive', started)
+                    result = clean_pdf(spool, dest, timer)
+        os.replace(part_path, output_path)
+    except Exception:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    result['output'] = output_path
+    return result
+
+
+def clean_path(path, output_stem):
+    with open(path, 'rb') as f:
+        return clean_stream(f, output_stem)
+
+
+def prune_outputs(folder, max_age):
+    """Remove cleaned documents older than max_age seconds from folder"""
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
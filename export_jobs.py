@@ -0,0 +1,164 @@
+"""Asynchronous merge jobs for the web service.
+
+Jobs run on a bounded thread pool so request handlers return at once,
+and any gunicorn worker process can report on or serve a job (see
+jobs.JobManager), whichever worker accepted it. With a result cache, jobs hash their inputs as they merge
+them and store the output under the key of exactly those bytes. A job
+submitted while another for the same key, or the same files and options,
+is still queued or running shares that job instead of merging again.
+
+Every job is traced: its stage timings feed /metrics and are reported in
+its status. With traces enabled the whole trace, file by file, is also
+kept as <output_dir>/<job_id>.trace.json.
+"""
+import os
+import threading
+import time
+import uuid
+
+from instrumentation import Trace
+from jobs import JobManager, JobQueueFull
+from merge_engine import MergeCancelled, merge_files
+
+
+class ExportJob:
+    def __init__(self, job_id, pdf_files, output_path, filename, outline=False, dedup=False, cache_key=None):
+        self.job_id = job_id
+        self.pdf_files = list(pdf_files)
+        self.output_path = output_path
+        self.filename = filename
+        self.outline = outline
+        self.dedup = dedup
+        self.cache_key = cache_key
+        self.status = 'queued'
+        self.done = 0
+        self.pages = 0
+        self.bytes_saved = 0
+        self.errors = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.trace = Trace(job_id, files=len(self.pdf_files), outline=outline, dedup=dedup)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'filename': self.filename,
+            'result_id': self.cache_key,
+            'progress': {'done': self.done, 'total': len(self.pdf_files)},
+            'pages': self.pages,
+            'bytes_saved': self.bytes_saved,
+            'errors': [{'file': os.path.basename(p), 'error': e} for p, e in self.errors],
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+            'stages': {stage: entry['seconds'] for stage, entry in self.trace.stages.items()},
+        }
+
+
+class ExportJobManager(JobManager):
+    def __init__(self, output_dir, max_workers=2, max_queued=16, job_ttl=3600, cache=None, writer_processes=1,
+                 traces=False):
+        super().__init__(output_dir, job_ttl)
+        self.traces = traces
+        self.writer_processes = writer_processes
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+
+    def submit(self, pdf_files, filename, outline=False, dedup=False, cache_key=None):
+        """Queue a merge of pdf_files and return its ExportJob.
+
+        Raises JobQueueFull when max_queued jobs are already queued or
+        running in this process.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.prune()
+        job_id = uuid.uuid4().hex
+        job = ExportJob(job_id, pdf_files, self._path(job_id, 'pdf'), filename, outline, dedup, cache_key)
+        with self._lock:
+            for other in self.jobs.values():
+                if other.status in ('queued', 'running') and (
+                        (cache_key is not None and other.cache_key == cache_key)
+                        or (other.pdf_files, other.outline, other.dedup) == (job.pdf_files, outline, dedup)):
+                    return other
+            active = self._active()
+            if active >= self.max_queued:
+                raise JobQueueFull(f"{active} export jobs already queued")
+            self.jobs[job_id] = job
+        self.write_status(job, force=True)
+        self.pool('export', self.max_workers).submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+        else:
+            job.status = 'running'
+            job.trace.add('queued', time.time() - job.created)
+            self.write_status(job, force=True)
+
+            def progress(index, total, path, error):
+                job.done = index
+                self.write_status(job)
+
+            try:
+                result = merge_files(job.pdf_files, job.output_path, progress=progress,
+                                     cancel=job.cancel_event, outline=[] if job.outline else None,
+                                     dedup=job.dedup, workers=self.writer_processes, trace=job.trace,
+                                     digests=self.cache is not None)
+            except MergeCancelled:
+                job.status = 'cancelled'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+            else:
+                job.pages = result.pages
+                job.bytes_saved = result.bytes_saved
+                job.errors = result.errors
+                if self.cache is not None and len(result.hashes) == len(set(job.pdf_files)):
+                    self.cache.remember(result.hashes)
+                    job.cache_key = self.cache.key(job.pdf_files, [result.hashes[p][2] for p in job.pdf_files],
+                                                   outline=job.outline, dedup=job.dedup)
+                    try:
+                        self.cache.put(job.cache_key, job.output_path, {
+                            'pages': result.pages,
+                            'bytes_saved': result.bytes_saved,
+                            'errors': job.to_dict()['errors'],
+                        })
+                    except OSError:
+                        # The job's own copy can still be downloaded
+                        pass
+                job.status = 'done'
+        job.finished = time.time()
+        if self.traces:
+            try:
+                job.trace.write(self._path(job.job_id, 'trace.json'))
+            except OSError:
+                pass
+        self.write_status(job, force=True)
+
+    def output_path(self, job_id):
+        return self._path(job_id, 'pdf')
+
+    def trace_path(self, job_id):
+        return self._path(job_id, 'trace.json')
+
+    def cancel(self, job_id):
+        """Cancel a job accepted by this process; return False if it is not ours"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def prune(self):
+        """Forget finished jobs older than job_ttl and delete their files"""
+        for job_id in self.forget_expired():
+            for ext in ('pdf', 'json', 'trace.json'):
+                try:
+                    os.remove(self._path(job_id, ext))
+                except OSError:
+                    pass
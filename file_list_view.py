@@ -0,0 +1,226 @@
+"""Virtualized file list for the merger GUI.
+
+FileListModel holds the file order compactly: reversing it flips a flag
+and moving k selected files is k swaps. VirtualListbox shows a model in a
+Tk Listbox that only ever holds the rows on screen, so folders with tens
+of thousands of files redraw as fast as small ones.
+"""
+import tkinter as tk
+from tkinter import font as tkfont
+
+
+class FileListModel:
+    """An ordered list of items with O(1) reversal and a selection that follows moves"""
+
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._reversed = False
+        # Positions in _items, so reversing does not touch the selection
+        self._selected = set()
+        self.anchor = None
+
+    def _position(self, index):
+        if index < 0:
+            index += len(self._items)
+        if not 0 <= index < len(self._items):
+            raise IndexError("list index out of range")
+        return len(self._items) - 1 - index if self._reversed else index
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[self._position(index)]
+
+    def __iter__(self):
+        return reversed(self._items) if self._reversed else iter(self._items)
+
+    def set_items(self, items):
+        self._items = list(items)
+        self._reversed = False
+        self._selected.clear()
+        self.anchor = None
+
+    def update(self, removed=(), added=()):
+        """Drop the items in removed and show added after the last item.
+
+        The remaining items keep their order and selection.
+        """
+        removed = set(removed)
+        kept = [(p, item) for p, item in enumerate(self._items) if item not in removed]
+        moved = {p: q for q, (p, _) in enumerate(kept)}
+        self._items = [item for _, item in kept]
+        self._selected = {moved[p] for p in self._selected if p in moved}
+        present = set(self._items)
+        added = [item for item in added if item not in present]
+        if self._reversed:
+            # Shown last is stored first
+            self._items[:0] = reversed(added)
+            self._selected = {p + len(added) for p in self._selected}
+        else:
+            self._items.extend(added)
+        self.anchor = None
+
+    def reverse(self):
+        self._reversed = not self._reversed
+
+    def swap(self, i, j):
+        """Swap the items at i and j; selection moves with them"""
+        p, q = self._position(i), self._position(j)
+        items = self._items
+        items[p], items[q] = items[q], items[p]
+        selected = self._selected
+        if (p in selected) != (q in selected):
+            selected.symmetric_difference_update((p, q))
+
+    def is_selected(self, index):
+        return self._position(index) in self._selected
+
+    def select(self, index, selected=True):
+        if selected:
+            self._selected.add(self._position(index))
+        else:
+            self._selected.discard(self._position(index))
+
+    def select_range(self, first, last):
+        for index in range(min(first, last), max(first, last) + 1):
+            self._selected.add(self._position(index))
+
+    def clear_selection(self):
+        self._selected.clear()
+
+    def selection(self):
+        """Selected indices in ascending order"""
+        n = len(self._items)
+        if self._reversed:
+            return sorted(n - 1 - p for p in self._selected)
+        return sorted(self._selected)
+
+
+class VirtualListbox(tk.Frame):
+    """A scrolling list of a FileListModel that renders only its visible rows.
+
+    label(index, item) gives the text of a row and color(index, item), if
+    given, its foreground color or None. Call refresh() after changing the
+    model or anything the labels depend on.
+    """
+
+    def __init__(self, parent, model, label, color=None, selectmode=tk.EXTENDED, empty_text='', **options):
+        super().__init__(parent)
+        self.model = model
+        self.label = label
+        self.color = color
+        self.selectmode = selectmode
+        self.empty_text = empty_text
+        self.top = 0
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        self.listbox = tk.Listbox(self, exportselection=False, activestyle='none', **options)
+        self.listbox.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.row_height = tkfont.Font(font=self.listbox.cget('font')).metrics('linespace') + 1
+
+        self.listbox.bind('<Configure>', lambda event: self.refresh())
+        self.listbox.bind('<Button-1>', lambda event: self._click(event, 'set'))
+        self.listbox.bind('<Control-Button-1>', lambda event: self._click(event, 'toggle'))
+        self.listbox.bind('<Shift-Button-1>', lambda event: self._click(event, 'range'))
+        self.listbox.bind('<B1-Motion>', lambda event: 'break')
+        self.listbox.bind('<MouseWheel>', lambda event: self._scroll(-1 if event.delta > 0 else 1))
+        self.listbox.bind('<Button-4>', lambda event: self._scroll(-1))
+        self.listbox.bind('<Button-5>', lambda event: self._scroll(1))
+        for key in ('Up', 'Down', 'Prior', 'Next', 'Home', 'End'):
+            self.listbox.bind(f'<{key}>', lambda event, key=key: self._key(key))
+
+    def rows(self):
+        return max(1, self.listbox.winfo_height() // self.row_height)
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units' or 'pages')"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.model))
+        elif args[0] == 'scroll':
+            step = self.rows() if args[2] == 'pages' else 1
+            self.top += int(args[1]) * step
+        self.refresh()
+
+    def _scroll(self, units):
+        self.top += units * 3
+        self.refresh()
+        return 'break'
+
+    def see(self, index):
+        rows = self.rows()
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + rows:
+            self.top = index - rows + 1
+
+    def refresh(self):
+        model = self.model
+        n = len(model)
+        rows = self.rows()
+        self.top = max(0, min(self.top, n - rows))
+        listbox = self.listbox
+        listbox.delete(0, tk.END)
+        if not n:
+            if self.empty_text:
+                listbox.insert(tk.END, self.empty_text)
+            self.scrollbar.set(0, 1)
+            return
+        # One row more than fits, for a partly visible last row
+        for row, index in enumerate(range(self.top, min(n, self.top + rows + 1))):
+            item = model[index]
+            listbox.insert(tk.END, self.label(index, item))
+            color = self.color(index, item) if self.color else None
+            if color:
+                listbox.itemconfig(row, {'fg': color})
+            if model.is_selected(index):
+                listbox.selection_set(row)
+        self.scrollbar.set(self.top / n, min(1.0, (self.top + rows) / n))
+
+    def _click(self, event, mode):
+        self.listbox.focus_set()
+        index = self.top + self.listbox.nearest(event.y)
+        model = self.model
+        if index >= len(model):
+            return 'break'
+        if self.selectmode in (tk.SINGLE, tk.BROWSE):
+            mode = 'set'
+        if mode == 'toggle':
+            model.select(index, not model.is_selected(index))
+        elif mode == 'range' and model.anchor is not None:
+            model.clear_selection()
+            model.select_range(min(model.anchor, len(model) - 1), index)
+        else:
+            model.clear_selection()
+            model.select(index)
+        if mode != 'range' or model.anchor is None:
+            model.anchor = index
+        self.refresh()
+        return 'break'
+
+    def _key(self, key):
+        model = self.model
+        n = len(model)
+        if not n:
+            return 'break'
+        selection = model.selection()
+        current = selection[0] if selection else self.top
+        rows = self.rows()
+        index = {
+            'Up': current - 1,
+            'Down': current + 1,
+            'Prior': current - rows,
+            'Next': current + rows,
+            'Home': 0,
+            'End': n - 1,
+        }[key]
+        index = max(0, min(index, n - 1))
+        model.clear_selection()
+        model.select(index)
+        model.anchor = index
+        self.see(index)
+        self.refresh()
+        return 'break'
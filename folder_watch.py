@@ -0,0 +1,271 @@
+"""Watch a source folder and re-merge when its PDFs settle.
+
+On Linux the folder is watched with inotify, so only the files named in
+events are looked at again; elsewhere, or if inotify is unavailable, the
+folder is rescanned every poll interval. Changes are debounced: a burst
+of copies is reported once, after nothing has changed for the debounce
+period and the changed files still have the size and mtime they had.
+
+The watcher is a BackgroundJob that queues ('changed', FolderChange)
+events for its owner to poll.
+
+Usage:
+    python folder_watch.py FOLDER -o merged.pdf [--subfolders] [--sort name|date|size]
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from merge_engine import merge_files, scan_pdf_files, sort_pdf_entries
+from merge_worker import BackgroundJob
+
+# Seconds without changes before a change is reported
+DEBOUNCE_SECONDS = 2.0
+
+# Seconds between rescans when inotify is not available
+POLL_INTERVAL = 2.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FolderChange:
+    def __init__(self, added, removed, modified, entries):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        # (path, size, mtime) of every PDF now in the folder, as scan_pdf_files returns
+        self.entries = entries
+
+
+class Inotify:
+    """Minimal inotify binding: add watches and read the paths that changed"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+
+    def add_watch(self, folder):
+        wd = self._add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {folder}")
+        self.folders[wd] = folder
+
+    def read(self, timeout):
+        """Wait up to timeout seconds and return [(mask, path)] of the events read"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            folder = self.folders.get(wd)
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+            if folder is not None or mask & IN_Q_OVERFLOW:
+                events.append((mask, os.path.join(folder, os.fsdecode(name)) if folder and name else folder))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher(BackgroundJob):
+    """Report debounced changes to the PDFs in folder until cancelled.
+
+    Paths in ignore (e.g. the merge output, if it is written into the
+    watched folder) are never reported.
+    """
+
+    def __init__(self, folder, include_subfolders=False, debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL,
+                 ignore=(), use_inotify=True):
+        super().__init__()
+        self.folder = folder
+        self.include_subfolders = include_subfolders
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.ignore = {os.path.abspath(p) for p in ignore}
+        self.use_inotify = use_inotify
+        self.entries = {}
+        self.backend = None
+
+    def _scan(self, folder=None):
+        return {path: (size, mtime) for path, size, mtime in
+                scan_pdf_files(folder or self.folder, self.include_subfolders)
+                if os.path.abspath(path) not in self.ignore}
+
+    def _watch_tree(self, inotify, folder):
+        inotify.add_watch(folder)
+        if self.include_subfolders:
+            for root, dirs, _ in os.walk(folder):
+                for name in dirs:
+                    inotify.add_watch(os.path.join(root, name))
+
+    def _apply(self, inotify, events):
+        """Update entries from inotify events; return False if a full rescan is needed"""
+        for mask, path in events:
+            if mask & IN_Q_OVERFLOW or path is None:
+                return False
+            if path == self.folder and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                return False
+            if mask & IN_ISDIR:
+                if not self.include_subfolders:
+                    continue
+                prefix = path + os.sep
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(inotify, path)
+                    except OSError:
+                        pass
+                    self.entries.update(self._scan(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    for known in [p for p in self.entries if p.startswith(prefix)]:
+                        del self.entries[known]
+            elif path.lower().endswith('.pdf') and os.path.abspath(path) not in self.ignore:
+                try:
+                    st = os.stat(path)
+                    self.entries[path] = (st.st_size, st.st_mtime)
+                except OSError:
+                    self.entries.pop(path, None)
+        return True
+
+    def _stable(self, changed):
+        """True if every changed path still has the size and mtime last seen"""
+        for path in changed:
+            try:
+                st = os.stat(path)
+                current = (st.st_size, st.st_mtime)
+            except OSError:
+                current = None
+            if current != self.entries.get(path):
+                return False
+        return True
+
+    def work(self):
+        inotify = None
+        if self.use_inotify and sys.platform.startswith('linux'):
+            try:
+                inotify = Inotify()
+                self._watch_tree(inotify, self.folder)
+            except (OSError, AttributeError):
+                # e.g. out of watches; polling still works
+                if inotify is not None:
+                    inotify.close()
+                inotify = None
+        self.backend = 'inotify' if inotify is not None else 'polling'
+        baseline = self._scan()
+        self.entries = dict(baseline)
+        last_change = None
+        try:
+            while not self._cancel.is_set():
+                before = dict(self.entries)
+                if inotify is not None:
+                    events = inotify.read(min(self.poll_interval, self.debounce / 2))
+                    if not self._apply(inotify, events):
+                        self.entries = self._scan()
+                else:
+                    self._cancel.wait(self.poll_interval)
+                    self.entries = self._scan()
+                if self.entries != before:
+                    last_change = time.monotonic()
+                if last_change is None or time.monotonic() - last_change < self.debounce:
+                    continue
+                changed = [p for p in set(baseline) | set(self.entries)
+                           if baseline.get(p) != self.entries.get(p)]
+                if not self._stable(changed):
+                    # Still being written without events reaching us (e.g. a network share)
+                    self.entries = self._scan()
+                    last_change = time.monotonic()
+                    continue
+                last_change = None
+                if changed:
+                    self.events.put(('changed', FolderChange(
+                        added=sorted(p for p in changed if p not in baseline),
+                        removed=sorted(p for p in changed if p not in self.entries),
+                        modified=sorted(p for p in changed if p in baseline and p in self.entries),
+                        entries=[(p, size, mtime) for p, (size, mtime) in self.entries.items()],
+                    )))
+                baseline = dict(self.entries)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a folder and re-merge its PDFs whenever they change")
+    parser.add_argument('folder')
+    parser.add_argument('-o', '--output', required=True, help="output PDF path")
+    parser.add_argument('--subfolders', action='store_true', help="include PDFs in subfolders")
+    parser.add_argument('--sort', choices=['name', 'date', 'size'], default='name')
+    parser.add_argument('--outline', action=argparse.BooleanOptionalAction, default=True,
+                        help="add a bookmark per file (default)")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help="seconds the folder must be quiet before merging")
+    parser.add_argument('--poll', action='store_true', help="rescan periodically instead of using inotify")
+    args = parser.parse_args(argv)
+
+    def merge(entries):
+        pdf_files = sort_pdf_entries(entries, args.sort)
+        if not pdf_files:
+            print("No PDF files to merge", flush=True)
+            return
+        result = merge_files(pdf_files, args.output, outline=[] if args.outline else None, incremental=True)
+        print(f"Merged {result.pages} pages from {result.files} of {len(pdf_files)} PDFs into {args.output} "
+              f"({result.reused} reused)", flush=True)
+        for path, error in result.errors:
+            print(f"Error: {os.path.basename(path)} - {error}", file=sys.stderr, flush=True)
+
+    watcher = FolderWatcher(args.folder, args.subfolders, args.debounce, ignore=[args.output],
+                            use_inotify=not args.poll).start()
+    merge(scan_pdf_files(args.folder, args.subfolders))
+    try:
+        while watcher.is_alive():
+            for kind, payload in watcher.poll():
+                if kind == 'changed':
+                    print(f"{len(payload.added)} added, {len(payload.removed)} removed, "
+                          f"{len(payload.modified)} modified", flush=True)
+                    merge(payload.entries)
+                elif kind == 'failed':
+                    print(f"Error: {payload}", file=sys.stderr)
+                    return 1
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        watcher.cancel()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Gunicorn settings for the web service: gunicorn -c gunicorn.conf.py
+
+The app is created and warmed once in the master (app.create_app) and the
+workers are forked from it, so they start without importing anything.
+Set WEB_CONCURRENCY for the number of workers, and MERGE_SOURCE_ROOT to
+the folder requests may read source files from (the app will not start
+without it). Merging, batches and document cleaning run as background
+jobs, but /find_xml_tags scans in the request and uploads are received
+in it, so a worker gets GUNICORN_TIMEOUT seconds (default 300) for a request before it is killed.
+
+Workers pool their metrics in METRICS_DIR, emptied when the server
+starts, so /metrics answers for all of them whichever worker is scraped.
+"""
+import os
+import tempfile
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(),
+                                                  f"indesign-metrics-{os.environ.get('PORT', '8000')}"))
+
+
+def on_starting(server):
+    from instrumentation import clear_shared
+
+    clear_shared(os.environ['METRICS_DIR'])
+
+
+def child_exit(server, worker):
+    from instrumentation import fold_dead
+
+    fold_dead(os.environ['METRICS_DIR'], worker.pid)
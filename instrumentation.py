@@ -0,0 +1,412 @@
+"""Stage timers, counters and a Prometheus text exporter.
+
+Metrics live in a process-wide registry and are rendered in the
+Prometheus text format by /metrics. Under gunicorn each worker process
+keeps its own registry; shared through a directory (Registry.share),
+every worker writes a snapshot of it there, at most once per interval
+after a change, and any worker renders the sum of all of them, as
+prometheus_client's multiprocess mode does. Counters and histograms of
+exited workers are folded into dead.json (fold_dead) and keep counting.
+A Trace collects the stages of one merge and can be written out as JSON.
+"""
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Snapshot of workers that have exited, see fold_dead
+DEAD_SNAPSHOT = 'dead.json'
+
+# Upper bounds in seconds; an implicit +Inf bucket follows
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for name, value in zip(names, values))
+    return '{%s}' % pairs
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.on_change = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), self._export(value)] for key, value in self.values.items()]
+        return {'kind': self.kind, 'help': self.help, 'labels': list(self.label_names), 'values': values}
+
+    def _export(self, value):
+        return value
+
+    def merge(self, key, value):
+        """Add value, from another process's snapshot, to the sample at key"""
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.label_names, key), value) for key, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+        self._changed()
+
+
+class Gauge(Metric):
+    """A value that goes up and down.
+
+    Across processes gauges are summed, or with multiprocess='all' kept
+    apart by a pid label. Gauges of exited processes are dropped.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), multiprocess='sum'):
+        super().__init__(name, help, labels)
+        self.multiprocess = multiprocess
+        self.function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+        self._changed()
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+        self._changed()
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time instead"""
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, '', self.function())]
+        return super().samples()
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        if self.function is not None:
+            snapshot['values'] = [[[], self.function()]]
+        snapshot['multiprocess'] = self.multiprocess
+        return snapshot
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+        self._changed()
+
+    def _export(self, value):
+        counts, total, count = value
+        return [list(counts), total, count]
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+    def merge(self, key, value):
+        counts, total, count = value
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    samples.append((self.name + '_bucket', _labels(self.label_names + ('le',), key + (le,)),
+                                    cumulative))
+                labels = _labels(self.label_names, key)
+                samples.append((self.name + '_sum', labels, total))
+                samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.directory = None
+        self.interval = 1.0
+        self._dump_pending = None
+        self._lock = threading.Lock()
+
+    def _add(self, cls, name, help, labels=(), **options):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **options)
+                metric.on_change = self._changed
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), multiprocess='sum'):
+        return self._add(Gauge, name, help, labels, multiprocess=multiprocess)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram, name, help, labels, buckets=buckets)
+
+    def share(self, directory, interval=1.0):
+        """Write snapshots to directory and render the sum of every process's"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+
+    def _changed(self):
+        if self.directory is None:
+            return
+        with self._lock:
+            # Keyed by pid: a dump pending in a parent is not pending in a forked child
+            if self._dump_pending == os.getpid():
+                return
+            self._dump_pending = os.getpid()
+        timer = threading.Timer(self.interval, self.dump)
+        timer.daemon = True
+        timer.start()
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+    def dump(self):
+        """Write this process's snapshot to the shared directory now"""
+        with self._lock:
+            self._dump_pending = None
+        _write_json(os.path.join(self.directory, f"{os.getpid()}.json"), self.snapshot())
+
+    def load(self, snapshot, pid=None):
+        """Add a snapshot into this registry; gauges only if pid, a live process, is given"""
+        for name, data in snapshot.items():
+            labels, extra, options = tuple(data['labels']), (), {}
+            if data['kind'] == 'gauge':
+                if pid is None:
+                    continue
+                if data.get('multiprocess') == 'all':
+                    labels, extra = labels + ('pid',), (str(pid),)
+                options['multiprocess'] = data.get('multiprocess', 'sum')
+            elif data['kind'] == 'histogram':
+                options['buckets'] = tuple(data['buckets'])
+            metric = self._add(METRIC_KINDS[data['kind']], name, data['help'], labels, **options)
+            for key, value in data['values']:
+                metric.merge(tuple(key) + extra, value)
+
+    def collect(self):
+        """A registry holding the sum of every snapshot in the shared directory"""
+        self.dump()
+        total = Registry()
+        for name, pid in _snapshot_files(self.directory):
+            snapshot = _read_json(os.path.join(self.directory, name))
+            if snapshot is not None:
+                total.load(snapshot, pid)
+        return total
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format.
+
+        Once shared, the metrics are those of every process sharing the
+        directory.
+        """
+        if self.directory is not None:
+            return self.collect().render()
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+METRIC_KINDS = {cls.kind: cls for cls in (Counter, Gauge, Histogram)}
+
+
+def _write_json(path, data):
+    part_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(part_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(part_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_files(directory):
+    """(file name, pid) of the snapshots in directory; pid is None for dead.json"""
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if name == DEAD_SNAPSHOT:
+            yield name, None
+        elif ext == '.json' and stem.isdigit():
+            yield name, int(stem)
+
+
+def fold_dead(directory, pid):
+    """Fold the counters and histograms of exited process pid into dead.json.
+
+    Call from the process manager (gunicorn's child_exit), one process at
+    a time.
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    dead = Registry()
+    dead.load(_read_json(os.path.join(directory, DEAD_SNAPSHOT)) or {})
+    dead.load(snapshot)
+    _write_json(os.path.join(directory, DEAD_SNAPSHOT), dead.snapshot())
+    os.remove(path)
+
+
+def clear_shared(directory):
+    """Remove every snapshot from directory, before the processes sharing it start"""
+    os.makedirs(directory, exist_ok=True)
+    for name, _ in list(_snapshot_files(directory)):
+        os.remove(os.path.join(directory, name))
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('merge_stage_seconds', "Seconds spent per merge stage", ('stage',))
+BYTES_READ = REGISTRY.counter('merge_bytes_read_total', "Bytes of source PDFs merged")
+BYTES_WRITTEN = REGISTRY.counter('merge_bytes_written_total', "Bytes of merged output written")
+PAGES = REGISTRY.counter('merge_pages_total', "Pages written to merged outputs")
+FILES = REGISTRY.counter('merge_files_total', "Source files by outcome", ('result',))
+PAGES_PER_SECOND = REGISTRY.gauge('merge_last_pages_per_second', "Pages per second of the last merge",
+                                  multiprocess='all')
+
+
+class Trace:
+    """Timings and counts of one merge, by stage.
+
+    Stage times also feed merge_stage_seconds, and counts the matching
+    merge_*_total counters, so a Trace is all a merge needs to report.
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+        self.counts = {}
+        self.files = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += 1
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+        if name == 'bytes_read':
+            BYTES_READ.inc(value)
+        elif name == 'bytes_written':
+            BYTES_WRITTEN.inc(value)
+        elif name == 'pages':
+            PAGES.inc(value)
+
+    def file(self, path, result, **info):
+        """Record the outcome of one source file: 'ok', 'reused' or 'error'"""
+        with self._lock:
+            self.files.append(dict(info, path=path, result=result))
+        FILES.inc(result=result)
+
+    def finish(self):
+        self.finished = time.perf_counter() - self._start
+        pages = self.counts.get('pages', 0)
+        if pages and self.finished:
+            PAGES_PER_SECOND.set(pages / self.finished)
+
+    def to_dict(self):
+        seconds = self.finished if self.finished is not None else time.perf_counter() - self._start
+        pages = self.counts.get('pages', 0)
+        return {
+            'name': self.name,
+            'attrs': self.attrs,
+            'started': self.started,
+            'seconds': seconds,
+            'pages_per_second': pages / seconds if seconds else None,
+            'stages': self.stages,
+            'counts': self.counts,
+            'files': self.files,
+        }
+
+    def write(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+def stage(trace, name):
+    """trace.stage(name), or a no-op when trace is None"""
+    return trace.stage(name) if trace is not None else contextlib.nullcontext()
@@ -0,0 +1,91 @@
+"""What the web service's background job managers share.
+
+A JobManager keeps the jobs it accepted in memory and each job's status
+in <output_dir>/<job_id>.json, so any gunicorn worker process can report
+on a job, whichever worker accepted it. Jobs need a job_id, a status, a
+finished time (None until done) and a to_dict() of their status.
+"""
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Minimum seconds between progress writes to a status file
+STATUS_WRITE_INTERVAL = 0.5
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    def __init__(self, output_dir, job_ttl=3600):
+        self.output_dir = output_dir
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._last_writes = {}
+
+    def _path(self, job_id, ext=None):
+        return os.path.join(self.output_dir, f"{job_id}.{ext}" if ext else job_id)
+
+    def pool(self, name, workers):
+        """Return the thread pool called name, created on first use.
+
+        Pools are never created at import, so none is inherited across the
+        fork of a gunicorn --preload worker.
+        """
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                pool = self._pools[name] = ThreadPoolExecutor(workers, thread_name_prefix=name)
+            return pool
+
+    def write_status(self, job, force=False):
+        """Write job's status file, at most every STATUS_WRITE_INTERVAL seconds unless force"""
+        now = time.monotonic()
+        if not force and now - self._last_writes.get(job.job_id, 0) < STATUS_WRITE_INTERVAL:
+            return
+        self._last_writes[job.job_id] = now
+        status_path = self._path(job.job_id, 'json')
+        with open(status_path + '.tmp', 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(status_path + '.tmp', status_path)
+
+    def count(self, status):
+        """Number of this process's jobs with status, e.g. 'queued' or 'running'"""
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job.status == status)
+
+    def _active(self):
+        """Jobs of this process queued or running; call with _lock held"""
+        return sum(1 for job in self.jobs.values() if job.status in ('queued', 'running'))
+
+    def get(self, job_id):
+        """Return the status dict of job_id, or None if it is unknown"""
+        if not JOB_ID_RE.match(job_id):
+            return None
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def forget_expired(self):
+        """Drop this process's jobs that finished more than job_ttl ago and return their ids"""
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished is not None and job.finished < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+                self._last_writes.pop(job_id, None)
+        return expired
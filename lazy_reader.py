@@ -0,0 +1,71 @@
+"""Open source PDFs memory-mapped and read only the objects asked for.
+
+PdfReader parses the trailer and cross-reference table when it is opened
+and every other object on first use. Given a memory map instead of a file
+handle, each of those reads is a slice of the page cache rather than a
+read into a Python buffer, so counting the pages or reading the outline
+of a large chapter touches only the few pages of the file that hold those
+objects, and many files can be open at once without their contents on
+the Python heap.
+
+PyPDF2 itself is imported when the first reader is opened.
+"""
+import contextlib
+import mmap
+
+
+def open_reader(f, info=None):
+    """Open a PdfReader on f, decrypting files that have an empty password"""
+    from PyPDF2 import PdfReader
+
+    return unlock_reader(PdfReader(f), info)
+
+
+def unlock_reader(reader, info=None):
+    """Decrypt reader if it is encrypted with an empty password, and return it"""
+    if reader.is_encrypted:
+        if info is not None:
+            info.encrypted = True
+        if not reader.decrypt(''):
+            raise ValueError("File is encrypted and needs a password")
+    return reader
+
+
+@contextlib.contextmanager
+def map_file(f):
+    """Yield a read-only memory map of the open file f, or f itself if it cannot be mapped.
+
+    Empty files, pipes and some network filesystems cannot be mapped. The
+    map is closed on exit, so readers on it must not be used afterwards.
+    """
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        mapped = None
+    if mapped is None:
+        yield f
+        return
+    with mapped:
+        yield mapped
+
+
+@contextlib.contextmanager
+def open_mapped(path, info=None):
+    """Yield a PdfReader on a memory map of path, as open_reader does"""
+    with open(path, 'rb') as f, map_file(f) as source:
+        yield open_reader(source, info)
+
+
+def page_count(reader):
+    """Return the page count stored in the page tree root.
+
+    Only the catalog and the root /Pages node are read. Files without a
+    usable /Count fall back to walking the whole page tree.
+    """
+    try:
+        count = reader.trailer['/Root']['/Pages']['/Count']
+        if isinstance(count, int) and count >= 0:
+            return int(count)
+    except Exception:
+        pass
+    return len(reader.pages)
@@ -0,0 +1,553 @@
+"""Headless, streaming PDF merge engine.
+
+Pages are copied straight from each source into the output file and the
+source is closed as soon as its pages are written, so peak memory is bounded
+by the largest single input rather than by the whole merged book. Sources
+are read through memory maps (see lazy_reader), so only the objects a page
+uses are read from them.
+
+This module only imports the standard library: PyPDF2 and the writer in
+pdf_writer are loaded on first use, so scanning folders or starting the
+web service does not pay for them.
+
+Usage:
+    python merge_engine.py SOURCE [SOURCE ...] -o merged.pdf
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import Trace, stage
+from lazy_reader import map_file, open_reader
+
+
+class MergeCancelled(Exception):
+    pass
+
+
+# Fewer files than this are written in-process even when workers are allowed
+MIN_PARALLEL_FILES = 8
+
+
+class OutlineNode:
+    """A bookmark in the merged output.
+
+    path links the node to a source file whose first page it points at;
+    nodes without a page of their own point at their first descendant's.
+    """
+
+    def __init__(self, title, path=None, page_id=None):
+        self.title = title
+        self.path = path
+        self.page_id = page_id
+        self.children = []
+
+    def copy(self):
+        node = OutlineNode(self.title, self.path)
+        node.children = [child.copy() for child in self.children]
+        return node
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def first_page_id(self):
+        if self.page_id is not None:
+            return self.page_id
+        for child in self.children:
+            page_id = child.first_page_id()
+            if page_id is not None:
+                return page_id
+        return None
+
+
+def outline_tree(outline, reader=None, page_ids=None):
+    """Convert a PdfReader outline (nested lists) into a list of OutlineNode.
+
+    When reader and page_ids are given, each node's page_id is the output
+    object number of the page its destination points at.
+    """
+    nodes = []
+    for item in outline:
+        if isinstance(item, list):
+            children = outline_tree(item, reader, page_ids)
+            if nodes:
+                nodes[-1].children.extend(children)
+            else:
+                nodes.extend(children)
+        elif hasattr(item, 'title'):
+            node = OutlineNode(item.title)
+            if reader is not None and page_ids is not None:
+                index = reader.get_destination_page_number(item)
+                if 0 <= index < len(page_ids):
+                    node.page_id = page_ids[index]
+            nodes.append(node)
+    return nodes
+
+
+def outline_to_json(nodes, first_page_id):
+    """Serialize an outline with page numbers relative to first_page_id"""
+    return [[node.title,
+             None if node.page_id is None else node.page_id - first_page_id,
+             outline_to_json(node.children, first_page_id)]
+            for node in nodes]
+
+
+def outline_from_json(items, first_page_id):
+    nodes = []
+    for title, index, children in items:
+        node = OutlineNode(title, page_id=None if index is None else first_page_id + index)
+        node.children = outline_from_json(children, first_page_id)
+        nodes.append(node)
+    return nodes
+
+
+class MergeResult:
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.pages = 0
+        self.files = 0
+        self.reused = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.errors = []
+        # path -> (size, mtime_ns, sha256) of each file merged, with digests
+        self.hashes = {}
+
+
+def scan_pdf_files(folder, include_subfolders=False):
+    """Return (path, size, mtime) for every PDF in folder in a single scandir pass"""
+    entries = []
+    if not folder or not os.path.isdir(folder):
+        return entries
+
+    pending = [folder]
+    while pending:
+        current = pending.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if include_subfolders:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith('.pdf'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+    return entries
+
+
+def sort_pdf_entries(entries, sort_by="name"):
+    """Return the paths of scan_pdf_files entries sorted by name, date or size"""
+    if sort_by == "date":
+        entries = sorted(entries, key=lambda e: e[2])
+    elif sort_by == "size":
+        entries = sorted(entries, key=lambda e: e[1])
+    else:
+        entries = sorted(entries)
+    return [path for path, _, _ in entries]
+
+
+def file_sha256(f, chunk_size=1 << 20):
+    if isinstance(f, mmap.mmap):
+        # Hashed in place, without copying chunks out of the map
+        return hashlib.sha256(f).hexdigest()
+    digest = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def known_sha256(hashes, pdf, size, mtime):
+    """The hash hashes records for pdf as (size, mtime, sha256), if pdf still has that size and mtime"""
+    entry = hashes.get(pdf) if hashes else None
+    if entry is not None and (entry[0], entry[1]) == (size, mtime):
+        return entry[2]
+    return None
+
+
+def load_manifest(output_path):
+    """Return (entries, offsets) recorded in output_path by an incremental merge.
+
+    entries describe where each source landed in the output and offsets
+    maps object numbers to byte offsets. Both are empty if output_path is
+    missing, unreadable or was not written incrementally.
+    """
+    try:
+        from PyPDF2 import PdfReader
+
+        with open(output_path, 'rb') as f, map_file(f) as source:
+            reader = PdfReader(source)
+            info = reader.trailer.get('/Info')
+            manifest = info.get_object().get('/SourceManifest') if info is not None else None
+            if manifest is None:
+                return [], {}
+            return json.loads(manifest.get_object().get_data()), dict(reader.xref.get(0, {}))
+    except Exception:
+        return [], {}
+
+
+def source_unchanged(pdf, entry):
+    """True if pdf still has the content recorded in its manifest entry"""
+    try:
+        st = os.stat(pdf)
+    except OSError:
+        return False
+    if (st.st_size, st.st_mtime) == (entry['size'], entry['mtime']):
+        return True
+    if st.st_size != entry['size']:
+        return False
+    with open(pdf, 'rb') as f:
+        return file_sha256(f) == entry['sha256']
+
+
+def list_pdf_files(folder, include_subfolders=False, sort_by="name"):
+    """Return the PDF files in folder, sorted by name, date or size"""
+    return sort_pdf_entries(scan_pdf_files(folder, include_subfolders), sort_by)
+
+
+def count_objects(pdf):
+    """Return an upper bound on the object numbers add_document uses for pdf"""
+    with open(pdf, 'rb') as f, map_file(f) as source:
+        reader = open_reader(source)
+        size = int(reader.trailer.get('/Size', 0))
+        for ids in list(reader.xref.values()) + [reader.xref_objStm]:
+            if ids:
+                size = max(size, max(ids) + 1)
+        # A page listed twice in the page tree is written twice
+        return size + len(reader.pages)
+
+
+def write_section(pdf, section_path, first_id, limit, outline=False, digest=False):
+    """Write pdf as a standalone segment numbered from first_id, in a worker process.
+
+    Returns what merge_files needs to copy it into the output: the segment
+    record, the offsets of its objects, the file's hash if digest is set,
+    its size, mtime and mtime_ns.
+    """
+    from pdf_writer import StreamingPdfWriter
+
+    with open(section_path, 'wb') as out, open(pdf, 'rb') as f, map_file(f) as source:
+        writer = StreamingPdfWriter(out)
+        writer.reserve(first_id - 1)
+        sha256 = file_sha256(source) if digest else None
+        st = os.fstat(f.fileno())
+        writer.add_document(open_reader(source), [] if outline else None)
+    segment = writer.last_segment
+    if segment['last_id'] >= first_id + limit:
+        raise ValueError("File has more objects than its cross-reference table lists")
+    offsets = {idnum: writer.offsets[idnum] for idnum in range(first_id, segment['last_id'] + 1)}
+    return segment, offsets, sha256, st.st_size, st.st_mtime, st.st_mtime_ns
+
+
+def start_sections(executor, writer, pdf_files, section_dir, outline=False, digest=False, hashes=None):
+    """Submit write_section for each (index, path) in pdf_files, reserving their object numbers.
+
+    With digest, files are hashed as they are written unless hashes
+    already has them. Returns {index: (future, section_path)}, where
+    future is an exception instead for files whose object count could
+    not be read.
+    """
+    hashes = hashes or {}
+    counts = [(i, pdf, executor.submit(count_objects, pdf)) for i, pdf in pdf_files]
+    sections = {}
+    for i, pdf, future in counts:
+        section_path = os.path.join(section_dir, f"{i}.section")
+        try:
+            limit = future.result()
+        except Exception as e:
+            sections[i] = (e, section_path)
+            continue
+        first_id = len(writer.offsets)
+        writer.reserve(first_id + limit - 1)
+        sections[i] = (executor.submit(write_section, pdf, section_path, first_id, limit,
+                                       outline, digest and pdf not in hashes), section_path)
+    return sections
+
+
+def merge_files(pdf_files, output_path, metadata=None, progress=None, cancel=None, outline=None,
+                incremental=False, dedup=False, workers=1, trace=None, digests=False, hashes=None):
+    """Merge pdf_files into output_path and return a MergeResult.
+
+    Files that cannot be read are skipped and recorded in result.errors.
+    progress, if given, is called as progress(index, total, path, error)
+    after each source file. cancel is an optional threading.Event; once it
+    is set the merge stops before the next file, the partial output is
+    removed and MergeCancelled is raised.
+
+    outline, if not None, is a list of OutlineNode trees (e.g. the outline
+    of a sequence PDF) to rebuild in the output. Nodes whose path is a
+    merged file point at its first page and get that file's own bookmarks
+    nested underneath; merged files without a node get a top-level
+    bookmark named after the file. The outline is built as each file is
+    appended. Pass an empty list for per-file bookmarks only, as
+    PdfMerger.append adds; with None the output has no bookmarks.
+
+    Named destinations of every file are kept (see StreamingPdfWriter), so
+    links and cross-references into them still work.
+
+    With incremental, a /SourceManifest stream recording each source's hash
+    and byte range is stored next to /SourceFiles. On the next incremental
+    merge into the same output, unchanged sources are copied from the
+    previous output without being parsed, in whatever order they now
+    appear; only new or modified files are read.
+
+    With dedup, fonts, ICC profiles, images and any other object repeated
+    across files are written once and shared, and result.duplicates and
+    result.bytes_saved report what that avoided. Deduplicated files refer
+    to objects of the files before them, so an incremental merge cannot
+    reuse them and reads them again.
+
+    With workers above 1, files that have to be read are written in
+    parallel by that many processes, each into a standalone section
+    numbered from a range of object numbers reserved for it from the
+    file's cross-reference table. The sections are then copied into the
+    output in order, as for an incremental merge. Sections cannot share
+    objects, so with dedup the files are all written in-process instead.
+
+    With digests, every file is hashed from the same mapped bytes its
+    pages are read from, and result.hashes maps each path merged to its
+    (size, mtime_ns, sha256), so a result can be keyed by exactly what went
+    into it.
+
+    hashes, if given, maps paths to a (size, mtime, sha256) already taken,
+    e.g. from preflight's PdfInfo; files still at that size and mtime are
+    not hashed again.
+
+    trace, an optional instrumentation.Trace, gets the time of each stage
+    (manifest, hash, parse, append, outline, wait, copy, write), the bytes
+    read and written, the pages and the outcome of every file. For files
+    written in parallel only the wait for their section and its copy are
+    timed.
+    """
+    from pdf_writer import StreamingPdfWriter
+
+    result = MergeResult(output_path)
+    info = {'/SourceFiles': "; ".join([os.path.basename(p) for p in pdf_files])}
+    if metadata:
+        info.update(metadata)
+
+    nodes_by_path = {}
+    if outline is not None:
+        outline = [root.copy() for root in outline]
+        for root in outline:
+            for node in root.walk():
+                if node.path is not None:
+                    nodes_by_path.setdefault(node.path, []).append(node)
+
+    reusable = {}
+    old_offsets = {}
+    if incremental:
+        with stage(trace, 'manifest'):
+            entries, old_offsets = load_manifest(output_path)
+            for entry in entries:
+                pdf = entry['path']
+                if (pdf not in reusable and (outline is None or 'outline' in entry)
+                        and not entry.get('dedup') and source_unchanged(pdf, entry)):
+                    reusable[pdf] = entry
+            reusable = {pdf: reusable[pdf] for pdf in pdf_files if pdf in reusable}
+    manifest = []
+
+    total_files = len(pdf_files)
+    fresh = [(i, pdf) for i, pdf in enumerate(pdf_files, 1) if pdf not in reusable]
+    digest = incremental or digests
+    parallel = workers > 1 and not dedup and len(fresh) >= MIN_PARALLEL_FILES
+    partial_path = output_path + '.part'
+    try:
+        with contextlib.ExitStack() as stack:
+            out = stack.enter_context(open(partial_path, 'wb'))
+            writer = StreamingPdfWriter(out, dedup)
+            writer.trace = trace
+            if outline is not None:
+                writer.outline = outline
+            if reusable:
+                writer.reserve(max(entry['last_id'] for entry in reusable.values()))
+                previous = stack.enter_context(open(output_path, 'rb'))
+            sections = {}
+            if parallel:
+                section_dir = stack.enter_context(
+                    tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))))
+                # spawn rather than fork: callers run this from GUI and web worker threads
+                executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+                # Shut down before the section directory is removed
+                stack.callback(executor.shutdown, True, cancel_futures=True)
+                sections = start_sections(executor, writer, fresh, section_dir, outline is not None,
+                                          digest, hashes)
+            for i, pdf in enumerate(pdf_files, 1):
+                if cancel is not None and cancel.is_set():
+                    raise MergeCancelled("Merge cancelled")
+                outline_nodes = None
+                if outline is not None:
+                    outline_nodes = nodes_by_path.pop(pdf, None)
+                    if not outline_nodes:
+                        outline_nodes = [OutlineNode(os.path.splitext(os.path.basename(pdf))[0], pdf)]
+                        outline.append(outline_nodes[0])
+                error = None
+                started = time.perf_counter()
+                outcome = 'ok'
+                pages = size = None
+                try:
+                    entry = reusable.pop(pdf, None)
+                    if entry is not None:
+                        try:
+                            with stage(trace, 'copy'):
+                                pages = writer.copy_segment(previous, entry, old_offsets, outline_nodes)
+                            st = os.stat(pdf)
+                            sha256 = entry['sha256']
+                            size, mtime, mtime_ns = st.st_size, st.st_mtime, st.st_mtime_ns
+                            result.reused += 1
+                            outcome = 'reused'
+                        except ValueError:
+                            pages = None
+                    if pages is None and i in sections:
+                        future, section_path = sections.pop(i)
+                        segment = None
+                        try:
+                            if isinstance(future, Exception):
+                                raise future
+                            with stage(trace, 'wait'):
+                                segment, offsets, sha256, size, mtime, mtime_ns = future.result()
+                        except Exception:
+                            # e.g. more objects than its cross-reference table lists, or a
+                            # worker that died: add it below, which reports any real read error
+                            pass
+                        if segment is not None and digest and sha256 is None:
+                            sha256 = known_sha256(hashes, pdf, size, mtime)
+                            if sha256 is None:
+                                # Changed since it was hashed: add and hash it again below
+                                segment = None
+                        if segment is not None:
+                            try:
+                                with stage(trace, 'copy'), open(section_path, 'rb') as section:
+                                    pages = writer.copy_segment(section, segment, offsets, outline_nodes)
+                            except ValueError:
+                                # e.g. a named destination taken by an earlier file: add it again below
+                                pages = None
+                        if os.path.exists(section_path):
+                            os.remove(section_path)
+                    if pages is None:
+                        with open(pdf, 'rb') as f, map_file(f) as source:
+                            st = os.fstat(f.fileno())
+                            size, mtime, mtime_ns = st.st_size, st.st_mtime, st.st_mtime_ns
+                            sha256 = known_sha256(hashes, pdf, size, mtime) if digest else None
+                            if digest and sha256 is None:
+                                with stage(trace, 'hash'):
+                                    sha256 = file_sha256(source)
+                            with stage(trace, 'parse'):
+                                reader = open_reader(source)
+                            pages = writer.add_document(reader, outline_nodes)
+                    result.pages += pages
+                    result.files += 1
+                    if digests:
+                        result.hashes[pdf] = (size, mtime_ns, sha256)
+                    if incremental:
+                        manifest.append(dict(writer.last_segment, path=pdf, sha256=sha256, size=size,
+                                             mtime=mtime, dedup=writer.dedup))
+                except Exception as e:
+                    error = str(e)
+                    outcome = 'error'
+                    result.errors.append((pdf, error))
+                if trace is not None:
+                    if outcome == 'ok':
+                        trace.count('bytes_read', size)
+                    trace.file(pdf, outcome, pages=pages, bytes=size, seconds=time.perf_counter() - started,
+                               error=error)
+                if progress:
+                    progress(i, total_files, pdf, error)
+            with stage(trace, 'write'):
+                if incremental:
+                    writer.close(info, json.dumps(manifest, separators=(',', ':')).encode())
+                else:
+                    writer.close(info)
+            result.duplicates += writer.dedup_hits
+            result.bytes_saved += writer.dedup_saved
+        os.replace(partial_path, output_path)
+        if trace is not None:
+            trace.count('pages', result.pages)
+            if dedup:
+                trace.count('bytes_saved', result.bytes_saved)
+            trace.count('bytes_written', os.path.getsize(output_path))
+            trace.finish()
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge PDF files without loading them all into memory")
+    parser.add_argument('sources', nargs='+', help="PDF files or folders of PDF files, in merge order")
+    parser.add_argument('-o', '--output', required=True, help="output PDF path")
+    parser.add_argument('--subfolders', action='store_true', help="include PDFs in subfolders of source folders")
+    parser.add_argument('--sort', choices=['name', 'date', 'size'], default='name',
+                        help="order of PDFs found in source folders")
+    parser.add_argument('--outline', action=argparse.BooleanOptionalAction, default=True,
+                        help="add a bookmark per file with the file's own bookmarks nested underneath "
+                             "(default, as PdfMerger did)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse unchanged files from an earlier incremental merge into the same output")
+    parser.add_argument('--dedup', action='store_true',
+                        help="write fonts, images and other objects repeated across files only once")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="write files in this many parallel processes (not with --dedup)")
+    parser.add_argument('--sequence', metavar='PDF',
+                        help="order files by the bookmarks of this PDF and rebuild its bookmark tree")
+    parser.add_argument('--trace', metavar='JSON', help="write the time spent in each merge stage to this file")
+    args = parser.parse_args(argv)
+
+    pdf_files = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            pdf_files.extend(list_pdf_files(source, args.subfolders, args.sort))
+        else:
+            pdf_files.append(source)
+
+    if not pdf_files:
+        parser.error("no PDF files to merge")
+
+    outline = [] if args.outline else None
+    if args.sequence:
+        from bookmark_matcher import read_bookmark_sequence
+
+        outline, matches = read_bookmark_sequence(args.sequence, pdf_files)
+        ordered = list(dict.fromkeys(path for _, path, _ in matches if path is not None))
+        in_sequence = set(ordered)
+        pdf_files = ordered + [p for p in pdf_files if p not in in_sequence]
+
+    def report(index, total, path, error):
+        if error:
+            print(f"Error: {os.path.basename(path)} - {error}", file=sys.stderr)
+
+    trace = Trace(os.path.basename(args.output), files=len(pdf_files)) if args.trace else None
+    result = merge_files(pdf_files, args.output, progress=report, outline=outline, incremental=args.incremental,
+                         dedup=args.dedup, workers=args.workers, trace=trace)
+    if trace is not None:
+        trace.write(args.trace)
+    print(f"Merged {result.pages} pages from {result.files} of {len(pdf_files)} PDFs into {args.output}")
+    if args.incremental:
+        print(f"Reused {result.reused} unchanged files from the previous output")
+    if args.dedup:
+        print(f"Shared {result.duplicates} duplicate objects, saving {result.bytes_saved} bytes")
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
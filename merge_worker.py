@@ -0,0 +1,143 @@
+"""Run merges on a background thread so GUI event loops never block.
+
+Jobs report back through a thread-safe queue of (kind, payload) events
+that the owning event loop polls:
+
+    ('validated', (index, total, PdfInfo))
+    ('progress', (index, total, path, error))
+    ('done', result)
+    ('cancelled', None)
+    ('failed', message)
+"""
+import queue
+import threading
+
+from instrumentation import stage
+from merge_engine import MergeCancelled, merge_files
+from preflight import preflight_files
+
+
+class BackgroundJob:
+    def __init__(self):
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def poll(self):
+        """Return all events queued since the last call, without blocking"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def work(self):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            result = self.work()
+        except MergeCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('failed', str(e)))
+        else:
+            self.events.put(('done', result))
+
+    def _validated(self, index, total, info):
+        self.events.put(('validated', (index, total, info)))
+
+    def _progress(self, index, total, path, error):
+        self.events.put(('progress', (index, total, path, error)))
+
+    def validate(self, pdf_files, known_info=None, cache=None):
+        """Return {path: PdfInfo}, reusing entries of known_info and cache that are still current"""
+        known_info = known_info or {}
+        infos = {}
+        todo = []
+        for pdf in pdf_files:
+            info = known_info.get(pdf)
+            if info is None or info.is_stale():
+                info = cache.get(pdf) if cache is not None else None
+            if info is not None:
+                infos[pdf] = info
+            else:
+                todo.append(pdf)
+
+        offset = len(infos)
+        total = len(pdf_files)
+        for i, info in enumerate(infos.values(), 1):
+            self._validated(i, total, info)
+
+        def report(i, _, info):
+            self._validated(offset + i, total, info)
+
+        inspected = preflight_files(todo, progress=report, cancel=self._cancel)
+        if cache is not None:
+            cache.put_many(inspected)
+        for info in inspected:
+            infos[info.path] = info
+        if self._cancel.is_set():
+            raise MergeCancelled("Validation cancelled")
+        return infos
+
+
+class ValidateJob(BackgroundJob):
+    def __init__(self, pdf_files, known_info=None, cache=None):
+        super().__init__()
+        self.pdf_files = list(pdf_files)
+        self.known_info = known_info
+        self.cache = cache
+
+    def work(self):
+        return self.validate(self.pdf_files, self.known_info, self.cache)
+
+
+class MergeJob(BackgroundJob):
+    """Validate pdf_files, then merge the ones that passed into output_path.
+
+    Files already validated in known_info or cache and unchanged since are
+    not inspected again, and files that failed validation are never reopened
+    by the merge, which reuses the hashes validation took.
+
+    trace, an optional instrumentation.Trace, times validation as the
+    'validate' stage and is passed on to merge_files.
+    """
+
+    def __init__(self, pdf_files, output_path, metadata=None, known_info=None, cache=None, outline=None,
+                 incremental=False, dedup=False, workers=1, trace=None):
+        super().__init__()
+        self.pdf_files = list(pdf_files)
+        self.output_path = output_path
+        self.metadata = metadata
+        self.outline = outline
+        self.incremental = incremental
+        self.dedup = dedup
+        self.workers = workers
+        self.trace = trace
+        self.known_info = known_info
+        self.cache = cache
+        self.info = {}
+
+    def work(self):
+        with stage(self.trace, 'validate'):
+            self.info = self.validate(self.pdf_files, self.known_info, self.cache)
+        valid_files = [pdf for pdf in self.pdf_files if self.info[pdf].ok]
+        # Validation hashed every file already
+        hashes = {pdf: (self.info[pdf].size, self.info[pdf].mtime, self.info[pdf].sha256) for pdf in valid_files
+                  if self.info[pdf].sha256}
+        return merge_files(valid_files, self.output_path, metadata=self.metadata,
+                           progress=self._progress, cancel=self._cancel, outline=self.outline,
+                           incremental=self.incremental, dedup=self.dedup, workers=self.workers,
+                           trace=self.trace, hashes=hashes)
@@ -0,0 +1,93 @@
+"""Persistent per-file PDF metadata cache.
+
+Results of inspect_pdf are stored in SQLite keyed by absolute path and
+reused for as long as the file's size and mtime are unchanged, so
+re-scanning a folder needs one directory pass and no PDF parsing.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+from preflight import PdfInfo
+
+SCHEMA_VERSION = 1
+
+COLUMNS = ('path', 'size', 'mtime', 'pages', 'encrypted', 'has_outline', 'xref_ok',
+           'error', 'sha256', 'outline_titles')
+
+
+def default_cache_path():
+    base = (os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pdf-merger', 'metadata.sqlite3')
+
+
+class MetadataCache:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_cache_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # Shared between the Tk thread and background jobs
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS pdf_metadata")
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pdf_metadata (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    pages INTEGER,
+                    encrypted INTEGER,
+                    has_outline INTEGER,
+                    xref_ok INTEGER,
+                    error TEXT,
+                    sha256 TEXT,
+                    outline_titles TEXT
+                )""")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, entries):
+        """Return {path: PdfInfo} for the (path, size, mtime) entries still valid in the cache"""
+        found = {}
+        with self._lock:
+            for path, size, mtime in entries:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM pdf_metadata WHERE path = ?",
+                    (os.path.abspath(path),)).fetchone()
+                if row is None or (row[1], row[2]) != (size, mtime):
+                    continue
+                info = PdfInfo(path, size, mtime)
+                (_, _, _, info.pages, encrypted, has_outline, xref_ok,
+                 info.error, info.sha256, titles) = row
+                info.encrypted = bool(encrypted)
+                info.has_outline = bool(has_outline)
+                info.xref_ok = bool(xref_ok)
+                info.outline_titles = json.loads(titles) if titles else []
+                found[path] = info
+        return found
+
+    def get(self, path):
+        """Return the cached PdfInfo for path if the file is unchanged, else None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return self.get_many([(path, st.st_size, st.st_mtime)]).get(path)
+
+    def put_many(self, infos):
+        rows = [(os.path.abspath(info.path), info.size, info.mtime, info.pages, int(info.encrypted),
+                 int(info.has_outline), int(info.xref_ok), info.error, info.sha256,
+                 json.dumps(info.outline_titles))
+                for info in infos if info.size is not None]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO pdf_metadata ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
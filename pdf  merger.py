@@ -1,7 +1,23 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PyPDF2 import PdfMerger, PdfReader
 import os
+import sqlite3
+import time
+
+from bookmark_matcher import read_bookmark_sequence
+from file_list_view import FileListModel, VirtualListbox
+from folder_watch import FolderWatcher
+from instrumentation import Trace
+from merge_engine import scan_pdf_files, sort_pdf_entries
+from merge_worker import MergeJob, ValidateJob
+from metadata_cache import MetadataCache
+
+# Set to 1 to save a JSON trace of each merge's stages next to the output
+TRACE_MERGES = os.environ.get('PDF_MERGER_TRACE') == '1'
+
+# Processes that write files in parallel during a merge; sharing fonts and
+# images across files needs them all written in one process
+MERGE_WORKERS = int(os.environ.get('PDF_MERGER_WORKERS', 1))
 
 class BookmarkSequencePreview(tk.Toplevel):
     def __init__(self, parent, sequence, missing_files, current_files):
@@ -20,31 +36,16 @@ class BookmarkSequencePreview(tk.Toplevel):
         tk.Label(top_frame, text="Detected Bookmark Sequence", font=('Arial', 12, 'bold')).pack(anchor="w")
         tk.Label(top_frame, text="Files will be merged in the order shown below:").pack(anchor="w", pady=(0, 10))
         
-        # Sequence list
-        seq_frame = tk.Frame(bottom_frame)
-        seq_frame.pack(fill="both", expand=True)
-        
-        # Listbox with scrollbar
-        scrollbar = tk.Scrollbar(seq_frame)
-        scrollbar.pack(side="right", fill="y")
-        
-        self.listbox = tk.Listbox(
-            seq_frame, 
-            yscrollcommand=scrollbar.set,
+        # Sequence list, color coded; only the visible rows are drawn
+        self.listbox = VirtualListbox(
+            bottom_frame,
+            FileListModel(sequence),
+            label=lambda i, entry: f"{i+1:2d}. {'✓ ' if entry[1] == 'found' else '✗ '}{os.path.basename(entry[0])}",
+            color=lambda i, entry: {'missing': 'red', 'extra': 'blue'}.get(entry[1]),
             selectmode=tk.SINGLE,
             font=('Courier', 10)
         )
-        self.listbox.pack(side="left", fill="both", expand=True)
-        scrollbar.config(command=self.listbox.yview)
-        
-        # Add items to listbox with color coding
-        for i, (item, status) in enumerate(sequence, 1):
-            prefix = "✓ " if status == "found" else "✗ "
-            self.listbox.insert(tk.END, f"{i:2d}. {prefix}{os.path.basename(item)}")
-            if status == "missing":
-                self.listbox.itemconfig(i-1, {'fg': 'red'})
-            elif status == "extra":
-                self.listbox.itemconfig(i-1, {'fg': 'blue'})
+        self.listbox.pack(fill="both", expand=True)
         
         # Missing files section
         if missing_files:
@@ -57,9 +58,8 @@ class BookmarkSequencePreview(tk.Toplevel):
                 tk.Label(missing_frame, text=f"...and {len(missing_files)-5} more", fg="red").pack()
         
         # Current files not in sequence
-        current_basenames = [os.path.basename(f) for f in current_files]
-        extra_files = [f for f in current_files 
-                      if os.path.basename(f) not in [os.path.basename(s[0]) for s in sequence]]
+        sequence_names = {os.path.basename(s[0]) for s in sequence}
+        extra_files = [f for f in current_files if os.path.basename(f) not in sequence_names]
         
         if extra_files:
             extra_frame = tk.LabelFrame(bottom_frame, text="Current Files Not in Sequence", padx=5, pady=5)
@@ -120,8 +120,26 @@ class PDFMergerGUI:
         self.output_filename = tk.StringVar(value="merged.pdf")
         self.include_subfolders = tk.BooleanVar()
         self.sort_by = tk.StringVar(value="name")
-        self.pdf_files = []
+        self.build_outline = tk.BooleanVar(value=True)
+        self.incremental = tk.BooleanVar()
+        self.dedup = tk.BooleanVar()
+        self.watch = tk.BooleanVar()
+        self.pdf_files = FileListModel()
         self.sequence_pdf = tk.StringVar()
+        self.pdf_info = {}
+        try:
+            self.cache = MetadataCache()
+        except (OSError, sqlite3.Error):
+            self.cache = None
+        self.job = None
+        self.auto_job = None
+        self.watcher = None
+        self.watch_pending = False
+        self.merge_errors = []
+        self.pending_outline = []
+        self.sequence_outline = []
+        # Seconds the last folder scan and bookmark match took, for the merge trace
+        self.stage_seconds = {}
         
         # Create UI
         self.create_widgets()
@@ -168,29 +186,37 @@ class PDFMergerGUI:
         tk.Radiobutton(options_frame, text="Size", variable=self.sort_by, value="size",
                       command=self.update_file_list).grid(row=0, column=4, sticky="w")
         
-        # Output filename
-        tk.Label(self.root, text="Output Filename:").grid(row=4, column=0, sticky="w", padx=10, pady=(0, 5))
-        tk.Entry(self.root, textvariable=self.output_filename).grid(row=4, column=1, sticky="ew", padx=(0, 10), pady=(0, 5))
+        # Bookmarks in merged output
+        tk.Checkbutton(options_frame, text="Build bookmarks (from bookmark sequence if applied)",
+                     variable=self.build_outline).grid(row=1, column=0, columnspan=5, sticky="w")
+        
+        # Incremental re-merge
+        tk.Checkbutton(options_frame, text="Incremental re-merge (reuse unchanged files from existing output)",
+                     variable=self.incremental).grid(row=2, column=0, columnspan=5, sticky="w")
         
-        # File list with scrollbar
-        list_frame = tk.Frame(self.root)
-        list_frame.grid(row=5, column=0, columnspan=2, sticky="nsew", padx=10, pady=(0, 10))
+        # Shared resources
+        tk.Checkbutton(options_frame, text="Share fonts and images repeated across files (smaller output)",
+                     variable=self.dedup).grid(row=3, column=0, columnspan=5, sticky="w")
         
-        # Configure grid weights for list frame
-        list_frame.grid_columnconfigure(0, weight=1)
-        list_frame.grid_rowconfigure(0, weight=1)
+        # Watch folder
+        tk.Checkbutton(options_frame, text="Watch folder and re-merge automatically when files settle",
+                     variable=self.watch, command=self.restart_watcher).grid(row=4, column=0, columnspan=5, sticky="w")
         
-        scrollbar = tk.Scrollbar(list_frame)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        # Output filename
+        tk.Label(self.root, text="Output Filename:").grid(row=4, column=0, sticky="w", padx=10, pady=(0, 5))
+        tk.Entry(self.root, textvariable=self.output_filename).grid(row=4, column=1, sticky="ew", padx=(0, 10), pady=(0, 5))
         
-        self.listbox = tk.Listbox(
-            list_frame, 
-            yscrollcommand=scrollbar.set,
+        # File list; only the visible rows are drawn
+        self.listbox = VirtualListbox(
+            self.root,
+            self.pdf_files,
+            label=lambda i, pdf: self.file_label(pdf),
+            color=lambda i, pdf: self.file_color(pdf),
             selectmode=tk.EXTENDED,
+            empty_text="No PDF files found in selected folder",
             font=('Courier', 10)
         )
-        self.listbox.grid(row=0, column=0, sticky="nsew")
-        scrollbar.config(command=self.listbox.yview)
+        self.listbox.grid(row=5, column=0, columnspan=2, sticky="nsew", padx=10, pady=(0, 10))
         
         # Control buttons
         control_frame = tk.Frame(self.root)
@@ -200,6 +226,8 @@ class PDFMergerGUI:
         tk.Button(control_frame, text="Move Down", command=self.move_down).pack(side="left", padx=2)
         tk.Button(control_frame, text="Reverse", command=self.reverse_order).pack(side="left", padx=2)
         tk.Button(control_frame, text="Reset Order", command=self.update_file_list).pack(side="left", padx=2)
+        self.validate_button = tk.Button(control_frame, text="Validate", command=self.validate_files)
+        self.validate_button.pack(side="left", padx=2)
         
         # Progress and status
         self.progress = ttk.Progressbar(self.root, orient="horizontal", length=100, mode="determinate")
@@ -208,9 +236,16 @@ class PDFMergerGUI:
         self.status_label = tk.Label(self.root, text="Ready", fg="gray")
         self.status_label.grid(row=8, column=0, columnspan=2, sticky="w", padx=10)
         
-        # Merge button
-        tk.Button(self.root, text="Merge PDFs", command=self.merge_pdfs, bg="#4CAF50", fg="white",
-                font=('Arial', 10, 'bold')).grid(row=9, column=0, columnspan=2, pady=10)
+        # Merge and cancel buttons
+        merge_frame = tk.Frame(self.root)
+        merge_frame.grid(row=9, column=0, columnspan=2, pady=10)
+        
+        self.merge_button = tk.Button(merge_frame, text="Merge PDFs", command=self.merge_pdfs, bg="#4CAF50",
+                                      fg="white", font=('Arial', 10, 'bold'))
+        self.merge_button.pack(side="left", padx=5)
+        self.cancel_button = tk.Button(merge_frame, text="Cancel", command=self.cancel_job,
+                                       state=tk.DISABLED)
+        self.cancel_button.pack(side="left", padx=5)
     
     def browse_folder(self):
         folder_selected = filedialog.askdirectory()
@@ -255,57 +290,23 @@ class PDFMergerGUI:
     def extract_bookmark_sequence(self, pdf_path):
         """Extract sequence from PDF bookmarks"""
         sequence = []
-        found_titles = set()
         
-        with open(pdf_path, 'rb') as f:
-            reader = PdfReader(f)
-            
-            # Get all bookmarks (outlines)
-            if not reader.outline:
-                return [], []
-            
-            # Extract titles from bookmarks
-            bookmarks = self.flatten_bookmarks(reader.outline)
-            bookmark_titles = [bm.title for bm in bookmarks if hasattr(bm, 'title')]
-            
-            # Create mapping of basenames to full paths
-            basename_to_path = {os.path.basename(p): p for p in self.pdf_files}
-            
-            # Match bookmark titles to files
-            for title in bookmark_titles:
-                # Clean the title (remove common extensions if present)
-                clean_title = os.path.splitext(title)[0]
-                
-                # Try to match with and without .pdf extension
-                matches = []
-                for ext in ['', '.pdf', '.PDF']:
-                    potential_match = clean_title + ext
-                    if potential_match in basename_to_path:
-                        matches.append(basename_to_path[potential_match])
-                
-                if matches:
-                    # Use the first match
-                    matched_file = matches[0]
-                    sequence.append((matched_file, "found"))
-                    found_titles.add(title)
-                else:
-                    sequence.append((title, "missing"))
+        # Match bookmark titles to files, exactly by basename first and
+        # then by fuzzy name similarity
+        started = time.perf_counter()
+        self.pending_outline, matches = read_bookmark_sequence(pdf_path, self.pdf_files)
+        self.stage_seconds['bookmarks'] = time.perf_counter() - started
+        for title, matched_file, score in matches:
+            if matched_file is not None:
+                sequence.append((matched_file, "found"))
+            else:
+                sequence.append((title, "missing"))
         
         # Identify missing files (bookmarks without matches)
-        missing_files = [title for title in bookmark_titles if title not in found_titles]
+        missing_files = [title for title, matched_file, score in matches if matched_file is None]
         
         return sequence, missing_files
     
-    def flatten_bookmarks(self, outlines, level=0):
-        """Flatten nested bookmarks structure"""
-        flat = []
-        for item in outlines:
-            if isinstance(item, list):
-                flat.extend(self.flatten_bookmarks(item, level+1))
-            else:
-                flat.append(item)
-        return flat
-    
     def apply_bookmark_sequence(self, sequence, missing_files, extra_files, strict_mode):
         """Apply the sequence extracted from bookmarks"""
         if not sequence:
@@ -320,10 +321,10 @@ class PDFMergerGUI:
             new_order = sequence + extra_files
         
         # Update the display
-        self.pdf_files = new_order
-        self.listbox.delete(0, tk.END)
-        for pdf in self.pdf_files:
-            self.listbox.insert(tk.END, os.path.basename(pdf))
+        self.pdf_files.set_items(new_order)
+        self.sequence_outline = self.pending_outline
+        self.listbox.top = 0
+        self.listbox.refresh()
         
         # Show result message
         msg = f"Applied sequence from {len(sequence)} bookmarks"
@@ -335,141 +336,250 @@ class PDFMergerGUI:
         messagebox.showinfo("Sequence Applied", msg)
     
     def update_file_list(self):
-        self.listbox.delete(0, tk.END)
-        self.pdf_files = self.get_pdf_files()
-        
-        if not self.pdf_files:
-            self.listbox.insert(tk.END, "No PDF files found in selected folder")
+        self.pdf_files.set_items(self.get_pdf_files())
+        self.sequence_outline = []
+        self.listbox.top = 0
+        self.listbox.refresh()
+        self.restart_watcher()
+    
+    def restart_watcher(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        self.watch_pending = False
+        if self.watch.get() and os.path.isdir(self.folder_path.get()):
+            output_path = self.output_path()
+            self.watcher = FolderWatcher(self.folder_path.get(), self.include_subfolders.get(),
+                                         ignore=[output_path] if output_path else ()).start()
+            self.root.after(500, self.poll_watcher, self.watcher)
+    
+    def poll_watcher(self, watcher):
+        """Take folder changes from the watcher and re-merge once no job is running"""
+        if watcher is not self.watcher:
             return
-        
-        for pdf in self.pdf_files:
-            self.listbox.insert(tk.END, os.path.basename(pdf))
+        output_path = os.path.abspath(self.output_path() or '')
+        for kind, payload in watcher.poll():
+            if kind == 'changed':
+                # The output may have been renamed since the watcher started
+                entries = [e for e in payload.entries if os.path.abspath(e[0]) != output_path]
+                changed = [p for p in payload.added + payload.removed + payload.modified
+                           if os.path.abspath(p) != output_path]
+                if not changed:
+                    continue
+                if self.cache is not None:
+                    self.pdf_info.update(self.cache.get_many(entries))
+                # Keep the order and bookmark sequence the user set up; new
+                # files go at the end in the chosen sort order
+                added = set(payload.added)
+                self.pdf_files.update(payload.removed,
+                                      sort_pdf_entries([e for e in entries if e[0] in added], self.sort_by.get()))
+                self.listbox.refresh()
+                self.watch_pending = True
+            elif kind == 'failed':
+                self.watcher = None
+                self.watch.set(False)
+                messagebox.showerror("Error", f"Stopped watching the folder: {payload}")
+                return
+        if self.watch_pending and self.job is None and self.pdf_files:
+            self.watch_pending = False
+            self.merge_pdfs(auto=True)
+        self.root.after(500, self.poll_watcher, watcher)
+    
+    def file_label(self, pdf):
+        info = self.pdf_info.get(pdf)
+        if info is None:
+            return os.path.basename(pdf)
+        if not info.ok:
+            return f"{os.path.basename(pdf)}  (invalid: {info.error})"
+        return f"{os.path.basename(pdf)}  ({info.pages} pages)"
+    
+    def file_color(self, pdf):
+        info = self.pdf_info.get(pdf)
+        if info is not None and not info.ok:
+            return 'red'
+        return None
     
     def get_pdf_files(self):
-        folder = self.folder_path.get()
-        if not folder or not os.path.isdir(folder):
-            return []
-        
-        pdf_files = []
-        if self.include_subfolders.get():
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if file.lower().endswith('.pdf'):
-                        pdf_files.append(os.path.join(root, file))
-        else:
-            pdf_files = [os.path.join(folder, f) for f in os.listdir(folder) 
-                         if f.lower().endswith('.pdf')]
-        
-        # Sort files
-        if self.sort_by.get() == "name":
-            pdf_files.sort()
-        elif self.sort_by.get() == "date":
-            pdf_files.sort(key=lambda x: os.path.getmtime(x))
-        elif self.sort_by.get() == "size":
-            pdf_files.sort(key=lambda x: os.path.getsize(x))
-        
-        return pdf_files
+        started = time.perf_counter()
+        entries = scan_pdf_files(self.folder_path.get(), self.include_subfolders.get())
+        self.stage_seconds['scan'] = time.perf_counter() - started
+        if self.cache is not None:
+            self.pdf_info.update(self.cache.get_many(entries))
+        return sort_pdf_entries(entries, self.sort_by.get())
     
     def move_up(self):
-        selected = self.listbox.curselection()
+        selected = self.pdf_files.selection()
         if not selected or selected[0] == 0:
             return
         
-        for index in sorted(selected):
-            if index == 0:
-                continue
-            # Swap in listbox
-            item = self.listbox.get(index)
-            self.listbox.delete(index)
-            self.listbox.insert(index-1, item)
-            # Swap in pdf_files list
-            self.pdf_files[index], self.pdf_files[index-1] = self.pdf_files[index-1], self.pdf_files[index]
-        
-        # Maintain selection
-        new_selection = [i-1 for i in selected if i > 0]
-        self.listbox.selection_clear(0, tk.END)
-        for i in new_selection:
-            self.listbox.selection_set(i)
+        # Swapping moves the selection along with the files
+        for index in selected:
+            self.pdf_files.swap(index, index-1)
+        self.listbox.see(selected[0]-1)
+        self.listbox.refresh()
     
     def move_down(self):
-        selected = self.listbox.curselection()
+        selected = self.pdf_files.selection()
         if not selected or selected[-1] == len(self.pdf_files)-1:
             return
         
-        for index in sorted(selected, reverse=True):
-            if index == len(self.pdf_files)-1:
-                continue
-            # Swap in listbox
-            item = self.listbox.get(index)
-            self.listbox.delete(index)
-            self.listbox.insert(index+1, item)
-            # Swap in pdf_files list
-            self.pdf_files[index], self.pdf_files[index+1] = self.pdf_files[index+1], self.pdf_files[index]
-        
-        # Maintain selection
-        new_selection = [i+1 for i in selected if i < len(self.pdf_files)-1]
-        self.listbox.selection_clear(0, tk.END)
-        for i in new_selection:
-            self.listbox.selection_set(i)
+        for index in reversed(selected):
+            self.pdf_files.swap(index, index+1)
+        self.listbox.see(selected[-1]+1)
+        self.listbox.refresh()
     
     def reverse_order(self):
         self.pdf_files.reverse()
-        self.listbox.delete(0, tk.END)
-        for pdf in self.pdf_files:
-            self.listbox.insert(tk.END, os.path.basename(pdf))
+        self.listbox.refresh()
+    
+    def output_path(self):
+        output_file = self.output_filename.get()
+        if not output_file:
+            return None
+        if not output_file.lower().endswith('.pdf'):
+            output_file += '.pdf'
+        return os.path.join(self.folder_path.get(), output_file)
     
-    def merge_pdfs(self):
+    def merge_pdfs(self, auto=False):
+        """Merge the listed files; auto merges from watch mode are incremental and never ask"""
         if not self.pdf_files:
             messagebox.showerror("Error", "No PDF files to merge")
             return
         
-        output_file = self.output_filename.get()
-        if not output_file:
+        output_path = self.output_path()
+        if not output_path:
             messagebox.showerror("Error", "Please enter an output filename")
             return
         
-        if not output_file.lower().endswith('.pdf'):
-            output_file += '.pdf'
+        if os.path.exists(output_path) and not auto:
+            if not messagebox.askyesno("Confirm", f"{os.path.basename(output_path)} already exists. Overwrite?"):
+                return
         
-        output_path = os.path.join(self.folder_path.get(), output_file)
-        if os.path.exists(output_path):
-            if not messagebox.askyesno("Confirm", f"{output_file} already exists. Overwrite?"):
+        # The job works on its own copy of the file list, so the list can be
+        # reordered for the next job while this one writes
+        outline = self.sequence_outline if self.build_outline.get() else None
+        trace = Trace(os.path.basename(output_path), files=len(self.pdf_files), auto=auto)
+        for stage, seconds in self.stage_seconds.items():
+            trace.add(stage, seconds)
+        job = MergeJob(self.pdf_files, output_path, known_info=self.pdf_info, cache=self.cache,
+                       outline=outline, incremental=self.incremental.get() or auto, dedup=self.dedup.get(),
+                       workers=1 if self.dedup.get() else MERGE_WORKERS, trace=trace)
+        self.auto_job = job if auto else None
+        self.start_job(job)
+    
+    def validate_files(self):
+        if not self.pdf_files:
+            messagebox.showerror("Error", "No PDF files to validate")
+            return
+        self.start_job(ValidateJob(self.pdf_files, known_info=self.pdf_info, cache=self.cache))
+    
+    def start_job(self, job):
+        self.job = job.start()
+        self.merge_errors = []
+        self.merge_button.config(state=tk.DISABLED)
+        self.validate_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.status_label.config(text="Validating files...")
+        self.root.after(100, self.poll_job)
+    
+    def cancel_job(self):
+        if self.job:
+            self.job.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Cancelling...")
+    
+    def poll_job(self):
+        job = self.job
+        validated = []
+        for kind, payload in job.poll():
+            if kind == 'validated':
+                i, total, info = payload
+                validated.append(info)
+                if not info.ok:
+                    self.merge_errors.append(f"{os.path.basename(info.path)} - {info.error}")
+                self.status_label.config(text=f"Validating {os.path.basename(info.path)}... ({i}/{total})")
+                self.progress['value'] = (i/total)*100
+            elif kind == 'progress':
+                i, total, pdf, error = payload
+                if error:
+                    self.merge_errors.append(f"{os.path.basename(pdf)} - {error}")
+                self.status_label.config(text=f"Adding {os.path.basename(pdf)}... ({i}/{total})")
+                self.progress['value'] = (i/total)*100
+            else:
+                self.show_validated(validated)
+                self.finish_job()
+                if kind == 'done':
+                    self.report_job(job, payload)
+                elif kind == 'cancelled':
+                    self.status_label.config(text="Cancelled")
+                elif kind == 'failed':
+                    messagebox.showerror("Error", f"Failed to merge PDFs: {payload}")
                 return
         
-        try:
-            merger = PdfMerger()
-            total_files = len(self.pdf_files)
-            
-            # Store source files in metadata
-            merger.add_metadata({
-                '/SourceFiles': "; ".join([os.path.basename(p) for p in self.pdf_files])
-            })
-            
-            for i, pdf in enumerate(self.pdf_files, 1):
-                try:
-                    merger.append(pdf)
-                    self.status_label.config(text=f"Adding {os.path.basename(pdf)}...")
-                    self.progress['value'] = (i/total_files)*100
-                    self.root.update_idletasks()
-                except Exception as e:
-                    self.listbox.insert(tk.END, f"Error: {os.path.basename(pdf)} - {str(e)}")
-                    self.listbox.itemconfig(tk.END, {'fg': 'red'})
-            
-            with open(output_path, 'wb') as f:
-                merger.write(f)
-            
-            messagebox.showinfo("Success", 
-                f"Successfully merged {len(merger.pages)} pages from {total_files} PDFs\n"
-                f"Saved to: {output_path}")
-            
-            self.progress['value'] = 0
-            self.status_label.config(text="Ready")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to merge PDFs: {str(e)}")
-        finally:
-            if 'merger' in locals():
-                merger.close()
+        self.show_validated(validated)
+        self.root.after(100, self.poll_job)
+    
+    def show_validated(self, infos):
+        """Record pre-flight results and redraw the visible rows of the file list"""
+        if not infos:
+            return
+        for info in infos:
+            self.pdf_info[info.path] = info
+        self.listbox.refresh()
+    
+    def timing_summary(self, trace):
+        """One line of the merge's speed and its slowest stages"""
+        data = trace.to_dict()
+        stages = sorted(data['stages'].items(), key=lambda item: -item[1]['seconds'])
+        msg = f"{data['seconds']:.1f} s"
+        if data['pages_per_second']:
+            msg += f", {data['pages_per_second']:.0f} pages/s"
+        if stages:
+            msg += " (" + ", ".join(f"{name} {entry['seconds']:.1f} s" for name, entry in stages[:3]) + ")"
+        return msg
+    
+    def report_job(self, job, result):
+        if isinstance(job, MergeJob) and TRACE_MERGES:
+            try:
+                job.trace.write(job.output_path + '.trace.json')
+            except OSError:
+                pass
+        if job is self.auto_job:
+            # Watch mode merges report in the status line instead of a dialog
+            msg = (f"Re-merged {result.pages} pages from {result.files} PDFs at {time.strftime('%H:%M:%S')} "
+                   f"in {self.timing_summary(job.trace)}")
+            if self.merge_errors:
+                msg += f" ({len(self.merge_errors)} files could not be used)"
+            self.status_label.config(text=msg)
+            return
+        if isinstance(job, MergeJob):
+            title = "Success"
+            msg = (f"Successfully merged {result.pages} pages from {result.files} PDFs\n"
+                   f"Saved to: {job.output_path}")
+            if job.incremental:
+                msg += f"\nReused {result.reused} unchanged files from the previous output"
+            if job.dedup:
+                msg += f"\nShared {result.duplicates} repeated objects, saving {result.bytes_saved / 1048576:.1f} MB"
+            msg += f"\nTook {self.timing_summary(job.trace)}"
+        else:
+            title = "Validation Complete"
+            pages = sum(info.pages for info in result.values())
+            msg = f"Validated {len(result)} PDFs with {pages} pages"
+        
+        if self.merge_errors:
+            msg += f"\n\n{len(self.merge_errors)} files could not be used:\n"
+            msg += "\n".join(self.merge_errors[:5])
+            if len(self.merge_errors) > 5:
+                msg += f"\n...and {len(self.merge_errors)-5} more"
+        messagebox.showinfo(title, msg)
+    
+    def finish_job(self):
+        self.job = None
+        self.progress['value'] = 0
+        self.status_label.config(text="Ready")
+        self.merge_button.config(state=tk.NORMAL)
+        self.validate_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
 
 if __name__ == "__main__":
     root = tk.Tk()
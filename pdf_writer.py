@@ -0,0 +1,522 @@
+"""Streaming PDF writer used by the merge engine and the document cleaner.
+
+Kept apart from merge_engine because it needs PyPDF2 at import time; the
+engine imports it only when a merge starts.
+"""
+import hashlib
+import io
+import time
+import zlib
+
+from PyPDF2.generic import (
+    ArrayObject,
+    ByteStringObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    StreamObject,
+    TextStringObject,
+    create_string_object,
+)
+
+from instrumentation import stage
+from merge_engine import outline_from_json, outline_to_json, outline_tree
+
+# Reference chains longer than this are copied without deduplication
+MAX_DEDUP_DEPTH = 64
+
+# Name tree nodes nested deeper than this are not followed
+MAX_NAME_TREE_DEPTH = 32
+
+# Catalog entries the writer builds itself, never copied by keep_catalog
+REBUILT_CATALOG_KEYS = ('/Type', '/Pages', '/Outlines', '/Dests')
+
+
+def dest_key(value):
+    """('string', bytes) or ('name', bytes) for a named destination, None for anything else"""
+    if isinstance(value, NameObject):
+        return ('name', str(value).encode('utf-8'))
+    if isinstance(value, (TextStringObject, ByteStringObject)):
+        return ('string', value.original_bytes)
+    return None
+
+
+def write_dest_name(key, out):
+    kind, name = key
+    if kind == 'name':
+        NameObject(name.decode('utf-8')).write_to_stream(out, None)
+    else:
+        ByteStringObject(name).write_to_stream(out, None)
+
+
+def read_named_dests(reader):
+    """Return [(key, value)] for the named destinations of reader, see dest_key.
+
+    Both the /Dests name tree of PDF 1.2 and the older /Dests dictionary
+    of the catalog are read; values are returned as stored, unresolved.
+    """
+    dests = []
+    root = reader.trailer['/Root']
+
+    def walk(node, depth):
+        node = node.get_object()
+        names = node.get('/Names')
+        if names is not None:
+            names = names.get_object()
+            for i in range(0, len(names) - 1, 2):
+                key = dest_key(names[i])
+                if key is not None:
+                    dests.append((key, names[i + 1]))
+        if depth < MAX_NAME_TREE_DEPTH:
+            for kid in node.get('/Kids', []):
+                walk(kid, depth + 1)
+
+    names = root.get('/Names')
+    if names is not None and '/Dests' in names.get_object():
+        walk(names.get_object()['/Dests'], 0)
+    old_dests = root.get('/Dests')
+    if old_dests is not None:
+        for name, value in old_dests.get_object().items():
+            dests.append((dest_key(NameObject(name)), value))
+    return dests
+
+
+class StreamingPdfWriter:
+    """Write a PDF incrementally, one source document at a time.
+
+    Objects are serialized as soon as they are reached from a page, and only
+    their byte offsets are kept until the cross-reference table is written.
+
+    With dedup, every copied object is hashed after its references have
+    been renumbered, and an object identical to one already written (a
+    font program, image or ICC profile embedded again) is replaced by a
+    reference to the earlier copy. dedup_hits and dedup_saved count the
+    objects and bytes this avoided writing.
+
+    trace, if set to an instrumentation.Trace, gets the time add_document
+    spends copying objects ('append') and rebuilding bookmarks ('outline').
+
+    Named destinations of every document are carried into the output. A
+    name already used by an earlier document is renamed, along with the
+    links and GoTo actions of the document that refer to it.
+
+    catalog_entries and catalog_names hold the catalog entries, and the
+    /Names subtrees other than /Dests, copied by add_document(keep_catalog=True).
+    """
+
+    def __init__(self, stream, dedup=False):
+        self.stream = stream
+        self.dedup = dedup
+        self.dedup_index = {}
+        self.dedup_hits = 0
+        self.dedup_saved = 0
+        self.offsets = [None]
+        self.page_ids = []
+        self.outline = []
+        # Where the last document added landed in the output, see add_document
+        self.last_segment = None
+        self.trace = None
+        # (kind, name) -> serialized destination, see dest_key
+        self.named_dests = {}
+        # Renames of the document being added, applied to its /D and /Dest values
+        self._dest_renames = {}
+        self.catalog_entries = {}
+        self.catalog_names = {}
+        self.catalog_id = self._allocate()
+        self.pages_id = self._allocate()
+        stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _allocate(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def reserve(self, max_id):
+        """Keep object numbers up to max_id free for copy_segment"""
+        if max_id >= len(self.offsets):
+            self.offsets.extend([None] * (max_id + 1 - len(self.offsets)))
+
+    def _begin_object(self, idnum):
+        self.offsets[idnum] = self.stream.tell()
+        self.stream.write(b"%d 0 obj\n" % idnum)
+
+    def _end_object(self):
+        self.stream.write(b"\nendobj\n")
+
+    def _write_value(self, obj, resolve, out, parent_id=None):
+        write = out.write
+        if obj is None:
+            write(b"null")
+        elif isinstance(obj, IndirectObject):
+            write(b"%d 0 R" % resolve(obj))
+        elif isinstance(obj, DictionaryObject):
+            is_stream = isinstance(obj, StreamObject)
+            write(b"<<\n")
+            for key, value in obj.items():
+                if is_stream and key == "/Length":
+                    continue
+                key.write_to_stream(out, None)
+                write(b" ")
+                if parent_id is not None and key == "/Parent":
+                    write(b"%d 0 R" % parent_id)
+                elif (self._dest_renames and key in ("/D", "/Dest") and obj.get("/S") != "/GoToR"
+                      and dest_key(value) in self._dest_renames):
+                    write_dest_name(self._dest_renames[dest_key(value)], out)
+                else:
+                    self._write_value(value, resolve, out)
+                write(b"\n")
+            if is_stream:
+                data = obj._data
+                write(b"/Length %d\n>>\nstream\n" % len(data))
+                write(data)
+                write(b"\nendstream")
+            else:
+                write(b">>")
+        elif isinstance(obj, ArrayObject):
+            write(b"[")
+            for item in obj:
+                write(b" ")
+                self._write_value(item, resolve, out)
+            write(b" ]")
+        else:
+            obj.write_to_stream(out, None)
+
+    def _write_object(self, idnum, data):
+        self._begin_object(idnum)
+        self.stream.write(data)
+        self._end_object()
+
+    def _serialize(self, obj, resolve, parent_id=None):
+        out = io.BytesIO()
+        self._write_value(obj, resolve, out, parent_id)
+        return out.getvalue()
+
+    def _unique_dest(self, key, taken):
+        kind, name = key
+        n = 2
+        while (kind, b"%s-%d" % (name, n)) in taken:
+            n += 1
+        return (kind, b"%s-%d" % (name, n))
+
+    def add_document(self, reader, outline_nodes=None, keep_catalog=False):
+        """Copy every page of reader to the output and return the page count.
+
+        outline_nodes, if given, are pointed at the document's first page and
+        the document's own bookmarks are nested under the first of them.
+
+        Each document's objects are numbered contiguously and written as one
+        byte range, recorded in last_segment so a later incremental merge can
+        copy them back verbatim with copy_segment.
+
+        With keep_catalog, the document's catalog entries (/Lang,
+        /PageLabels, /AcroForm, /StructTreeRoot, /Metadata and the like) are
+        copied too, for writers of a single document. They are not part of
+        last_segment.
+        """
+        started = time.perf_counter()
+        first_id = len(self.offsets)
+        start = self.stream.tell()
+        id_map = {}
+        pending = []
+        in_progress = set()
+
+        try:
+            dests = read_named_dests(reader)
+        except Exception:
+            # Broken name trees should not cost the document its pages
+            dests = []
+        self._dest_renames = {}
+        taken = set(self.named_dests).union(key for key, _ in dests)
+        for key, _ in dests:
+            if key in self.named_dests and key not in self._dest_renames:
+                self._dest_renames[key] = self._unique_dest(key, taken)
+                taken.add(self._dest_renames[key])
+
+        def resolve(ref):
+            key = (ref.idnum, ref.generation)
+            new_id = id_map.get(key)
+            if new_id is not None:
+                return new_id
+            obj = ref.get_object()
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Pages":
+                # Page tree nodes are rebuilt, never copied
+                new_id = id_map[key] = self.pages_id
+            elif key in in_progress:
+                # A reference cycle: the object is still being serialized
+                # further up and is written there under this id, without dedup
+                new_id = id_map[key] = self._allocate()
+            elif not self.dedup or len(in_progress) >= MAX_DEDUP_DEPTH:
+                new_id = id_map[key] = self._allocate()
+                pending.append((new_id, obj))
+            else:
+                new_id = dedup_resolve(key, obj)
+            return new_id
+
+        def dedup_resolve(key, obj):
+            # Children are resolved (and deduplicated) first, so identical
+            # objects serialize to identical bytes whatever their source numbers
+            in_progress.add(key)
+            data = self._serialize(obj, resolve)
+            in_progress.discard(key)
+            new_id = id_map.get(key)
+            if new_id is None:
+                digest = hashlib.sha256(data).digest()
+                new_id = self.dedup_index.get(digest)
+                if new_id is not None:
+                    id_map[key] = new_id
+                    self.dedup_hits += 1
+                    self.dedup_saved += len(data)
+                    return new_id
+                new_id = id_map[key] = self.dedup_index[digest] = self._allocate()
+            self._write_object(new_id, data)
+            return new_id
+
+        pages = reader.pages
+        page_ids = []
+        for page in pages:
+            new_id = self._allocate()
+            ref = page.indirect_reference
+            if ref is not None:
+                id_map[(ref.idnum, ref.generation)] = new_id
+            page_ids.append(new_id)
+
+        def write_pending():
+            while pending:
+                obj_id, obj = pending.pop()
+                if self.dedup:
+                    self._write_object(obj_id, self._serialize(obj, resolve))
+                else:
+                    self._begin_object(obj_id)
+                    self._write_value(obj, resolve, self.stream)
+                    self._end_object()
+
+        for new_id, page in zip(page_ids, pages):
+            if self.dedup:
+                self._write_object(new_id, self._serialize(page, resolve, self.pages_id))
+            else:
+                self._begin_object(new_id)
+                self._write_value(page, resolve, self.stream, self.pages_id)
+                self._end_object()
+            write_pending()
+
+        added_dests = {}
+        for key, value in dests:
+            key = self._dest_renames.get(key, key)
+            if key not in added_dests:
+                added_dests[key] = self._serialize(value, resolve)
+                write_pending()
+        if keep_catalog:
+            self._copy_catalog(reader.trailer['/Root'], resolve, write_pending)
+        self._dest_renames = {}
+        self.named_dests.update(added_dests)
+
+        self.page_ids.extend(page_ids)
+        self.last_segment = {
+            'first_id': first_id,
+            'last_id': len(self.offsets) - 1,
+            'start': start,
+            'end': self.stream.tell(),
+            'pages': len(page_ids),
+        }
+        if added_dests:
+            # Object numbers are kept by copy_segment, so the serialized values stay valid
+            self.last_segment['dests'] = [[kind, name.decode('latin-1'), data.decode('latin-1')]
+                                          for (kind, name), data in added_dests.items()]
+
+        if self.trace is not None:
+            self.trace.add('append', time.perf_counter() - started)
+
+        if outline_nodes is not None and page_ids:
+            with stage(self.trace, 'outline'):
+                try:
+                    children = outline_tree(reader.outline, reader, page_ids)
+                except Exception:
+                    # A broken outline should not cost the document its pages
+                    children = []
+                self.last_segment['outline'] = outline_to_json(children, page_ids[0])
+                for node in outline_nodes:
+                    node.page_id = page_ids[0]
+                if outline_nodes:
+                    outline_nodes[0].children.extend(children)
+        return len(page_ids)
+
+    def _copy_catalog(self, catalog, resolve, write_pending):
+        for key, value in catalog.items():
+            if key in REBUILT_CATALOG_KEYS:
+                continue
+            names = value.get_object() if key == "/Names" else None
+            if isinstance(names, DictionaryObject):
+                for name_key, tree in names.items():
+                    if name_key != "/Dests":
+                        self.catalog_names[name_key] = self._serialize(tree, resolve)
+                        write_pending()
+            elif key != "/Names":
+                self.catalog_entries[key] = self._serialize(value, resolve)
+                write_pending()
+
+    def copy_segment(self, source, segment, source_offsets, outline_nodes=None):
+        """Copy a document written by an earlier merge back verbatim.
+
+        source is the earlier output opened for reading, segment its
+        last_segment record and source_offsets its xref offsets. The
+        segment keeps its object numbers, which must have been reserved.
+
+        Raises ValueError, before writing anything, if the segment does not
+        match source or one of its named destinations is already taken;
+        the document must then be added again with add_document.
+        """
+        dests = {(kind, name.encode('latin-1')): data.encode('latin-1')
+                 for kind, name, data in segment.get('dests', [])}
+        if any(key in self.named_dests for key in dests):
+            raise ValueError("A named destination of the segment is already used")
+        first_id, last_id = segment['first_id'], segment['last_id']
+        first_offset = source_offsets.get(first_id)
+        if first_offset is None or not segment['start'] <= first_offset < segment['end']:
+            raise ValueError("Previous output does not match its manifest")
+        source.seek(first_offset)
+        if not source.read(32).startswith(b"%d 0 obj" % first_id):
+            raise ValueError("Previous output does not match its manifest")
+
+        start = self.stream.tell()
+        source.seek(segment['start'])
+        remaining = segment['end'] - segment['start']
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise ValueError("Previous output is truncated")
+            self.stream.write(chunk)
+            remaining -= len(chunk)
+
+        shift = start - segment['start']
+        for idnum in range(first_id, last_id + 1):
+            offset = source_offsets.get(idnum)
+            self.offsets[idnum] = offset + shift if offset else None
+
+        page_ids = list(range(first_id, first_id + segment['pages']))
+        self.page_ids.extend(page_ids)
+        self.named_dests.update(dests)
+        self.last_segment = dict(segment, start=start, end=self.stream.tell())
+
+        if outline_nodes is not None and page_ids:
+            for node in outline_nodes:
+                node.page_id = page_ids[0]
+            if outline_nodes:
+                outline_nodes[0].children.extend(outline_from_json(segment.get('outline', []), page_ids[0]))
+        return len(page_ids)
+
+    def _write_outline_items(self, nodes, parent_id):
+        """Write nodes that lead to a page as siblings and return their object numbers"""
+        write = self.stream.write
+        nodes = [node for node in nodes if node.first_page_id() is not None]
+        ids = [self._allocate() for _ in nodes]
+        for i, (node, idnum) in enumerate(zip(nodes, ids)):
+            child_ids = self._write_outline_items(node.children, idnum)
+            self._begin_object(idnum)
+            write(b"<<\n/Title ")
+            create_string_object(node.title).write_to_stream(self.stream, None)
+            write(b"\n/Parent %d 0 R\n" % parent_id)
+            if i > 0:
+                write(b"/Prev %d 0 R\n" % ids[i - 1])
+            if i < len(ids) - 1:
+                write(b"/Next %d 0 R\n" % ids[i + 1])
+            if child_ids:
+                write(b"/First %d 0 R\n/Last %d 0 R\n/Count -%d\n" % (child_ids[0], child_ids[-1], len(child_ids)))
+            write(b"/Dest [ %d 0 R /Fit ]\n>>" % node.first_page_id())
+            self._end_object()
+        return ids
+
+    def _write_entries(self, entries):
+        for key, data in entries.items():
+            NameObject(key).write_to_stream(self.stream, None)
+            self.stream.write(b" %s\n" % data)
+
+    def _write_named_dests(self):
+        """Write the catalog's /Names dictionary and /Dests dictionary entries"""
+        write = self.stream.write
+        # Name tree keys must be sorted; a single root node holds them all
+        strings = sorted(key for key in self.named_dests if key[0] == 'string')
+        names = sorted(key for key in self.named_dests if key[0] == 'name')
+        if strings or self.catalog_names:
+            write(b"/Names <<\n")
+            if strings:
+                write(b"/Dests << /Names [\n")
+                self._write_dest_entries(strings)
+                write(b"] >>\n")
+            self._write_entries(self.catalog_names)
+            write(b">>\n")
+        if names:
+            write(b"/Dests <<\n")
+            self._write_dest_entries(names)
+            write(b">>\n")
+
+    def _write_dest_entries(self, keys):
+        for key in keys:
+            write_dest_name(key, self.stream)
+            self.stream.write(b" %s\n" % self.named_dests[key])
+
+    def close(self, metadata=None, manifest=None):
+        """Write the page tree, catalog, info dictionary and xref table.
+
+        manifest, if given, is stored as a compressed stream referenced from
+        the info dictionary as /SourceManifest.
+        """
+        write = self.stream.write
+
+        self._begin_object(self.pages_id)
+        kids = b" ".join(b"%d 0 R" % idnum for idnum in self.page_ids)
+        write(b"<<\n/Type /Pages\n/Count %d\n/Kids [ %s ]\n>>" % (len(self.page_ids), kids))
+        self._end_object()
+
+        outlines_id = None
+        if self.outline:
+            outlines_id = self._allocate()
+            top_ids = self._write_outline_items(self.outline, outlines_id)
+            self._begin_object(outlines_id)
+            if top_ids:
+                write(b"<<\n/Type /Outlines\n/First %d 0 R\n/Last %d 0 R\n/Count %d\n>>"
+                      % (top_ids[0], top_ids[-1], len(top_ids)))
+            else:
+                write(b"<<\n/Type /Outlines\n/Count 0\n>>")
+            self._end_object()
+
+        self._begin_object(self.catalog_id)
+        write(b"<<\n/Type /Catalog\n/Pages %d 0 R\n" % self.pages_id)
+        if outlines_id is not None:
+            write(b"/Outlines %d 0 R\n/PageMode /UseOutlines\n" % outlines_id)
+        self._write_named_dests()
+        self._write_entries({key: data for key, data in self.catalog_entries.items()
+                             if not (outlines_id is not None and key == "/PageMode")})
+        write(b">>")
+        self._end_object()
+
+        info_id = None
+        if metadata or manifest is not None:
+            info = DictionaryObject()
+            for key, value in (metadata or {}).items():
+                info[NameObject(key)] = create_string_object(str(value))
+            if manifest is not None:
+                manifest_id = self._allocate()
+                data = zlib.compress(manifest)
+                self._begin_object(manifest_id)
+                write(b"<<\n/Filter /FlateDecode\n/Length %d\n>>\nstream\n" % len(data))
+                write(data)
+                write(b"\nendstream")
+                self._end_object()
+                info[NameObject('/SourceManifest')] = IndirectObject(manifest_id, 0, None)
+            info_id = self._allocate()
+            self._begin_object(info_id)
+            info.write_to_stream(self.stream, None)
+            self._end_object()
+
+        xref_offset = self.stream.tell()
+        write(b"xref\n0 %d\n" % len(self.offsets))
+        write(b"0000000000 65535 f \n")
+        for offset in self.offsets[1:]:
+            if offset is None:
+                write(b"0000000000 00000 f \n")
+            else:
+                write(b"%010d 00000 n \n" % offset)
+
+        write(b"trailer\n<<\n/Size %d\n/Root %d 0 R\n" % (len(self.offsets), self.catalog_id))
+        if info_id is not None:
+            write(b"/Info %d 0 R\n" % info_id)
+        write(b">>\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
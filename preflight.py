@@ -0,0 +1,121 @@
+"""Parallel pre-flight validation of input PDFs.
+
+Every input is opened once in a process pool before merging, so corrupt,
+encrypted or empty files are reported up front instead of halfway through
+a merge.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from lazy_reader import map_file, page_count, unlock_reader
+from merge_engine import file_sha256
+
+# Below this many files the pool start-up costs more than it saves
+MIN_PARALLEL_FILES = 8
+
+
+class PdfInfo:
+    def __init__(self, path, size=None, mtime=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.pages = 0
+        self.encrypted = False
+        self.has_outline = False
+        self.xref_ok = False
+        self.error = None
+        self.sha256 = None
+        self.outline_titles = []
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def is_stale(self):
+        """True if the file changed on disk since it was inspected"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return True
+        return (st.st_size, st.st_mtime) != (self.size, self.mtime)
+
+
+def outline_titles(outline):
+    """Flatten a PdfReader outline into a list of titles"""
+    titles = []
+    for item in outline:
+        if isinstance(item, list):
+            titles.extend(outline_titles(item))
+        elif hasattr(item, 'title'):
+            titles.append(item.title)
+    return titles
+
+
+def inspect_pdf(path):
+    """Parse path and return a PdfInfo describing it"""
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        info = PdfInfo(path)
+        info.error = str(e)
+        return info
+
+    from PyPDF2 import PdfReader
+
+    info = PdfInfo(path, st.st_size, st.st_mtime)
+    try:
+        with open(path, 'rb') as f, map_file(f) as source:
+            info.sha256 = file_sha256(source)
+            try:
+                reader = PdfReader(source, strict=True)
+                info.xref_ok = True
+                # Only the file structure is held to strict; objects are read as a merge reads them
+                reader.strict = False
+            except Exception:
+                source.seek(0)
+                reader = PdfReader(source)
+            unlock_reader(reader, info)
+            info.pages = page_count(reader)
+            if not info.pages:
+                raise ValueError("File has no pages")
+            outlines = reader.trailer['/Root'].get('/Outlines')
+            info.has_outline = outlines is not None and '/First' in outlines.get_object()
+            if info.has_outline:
+                info.outline_titles = outline_titles(reader.outline)
+    except Exception as e:
+        info.error = str(e) or e.__class__.__name__
+    return info
+
+
+def preflight_files(pdf_files, max_workers=None, progress=None, cancel=None):
+    """Inspect pdf_files in parallel and return their PdfInfo in input order.
+
+    progress, if given, is called as progress(index, total, info). cancel is
+    an optional threading.Event that stops collecting results early, in
+    which case the returned list is shorter than pdf_files.
+    """
+    total_files = len(pdf_files)
+    workers = max_workers or os.cpu_count() or 1
+
+    if total_files < MIN_PARALLEL_FILES or workers == 1:
+        results = map(inspect_pdf, pdf_files)
+        executor = None
+    else:
+        # spawn rather than fork: callers run this from GUI and web worker threads
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        chunksize = max(1, total_files // (workers * 4))
+        results = executor.map(inspect_pdf, pdf_files, chunksize=chunksize)
+
+    infos = []
+    try:
+        for i, info in enumerate(results, 1):
+            infos.append(info)
+            if progress:
+                progress(i, total_files, info)
+            if cancel is not None and cancel.is_set():
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return infos
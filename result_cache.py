@@ -0,0 +1,185 @@
+"""Content-addressed cache of merge results on local disk.
+
+A result is keyed by the SHA-256 of its input files, in order, and of the
+options that shape the output, so the same merge requested again is
+served from disk whoever asks for it and whatever the files are called
+on the request. The cache is bounded in bytes; the least recently used
+results are evicted first, recency being kept in the files' mtimes so
+every worker process sharing the folder sees the same order.
+
+Inputs are hashed by the merge itself, from the bytes it reads, and the
+key is computed once it is done. A request can be answered from the
+cache without merging only while its files' hashes are memoised and
+their sizes and mtimes unchanged; see known_key. The memo is an SQLite
+table in the cache folder, so every worker process, and the next server
+run, sees the hashes any of them took. It keeps the max_hashes most
+recently used files.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+# Bump when the merge engine output changes, to invalidate old results
+CACHE_VERSION = 1
+
+KEY_RE = re.compile(r'^[0-9a-f]{64}$')
+
+HASHES_DB = 'input-hashes.sqlite3'
+
+# Seconds before a memoised hash's last use is written again by known_key
+HASH_USE_RESOLUTION = 600
+
+
+class ResultCache:
+    def __init__(self, folder, max_bytes=2 << 30, max_hashes=100000):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_hashes = max_hashes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.folder, f"{key}.{ext}")
+
+    def _db(self):
+        """This process's connection to the hash memo; call with _lock held"""
+        # Opened per process, since a connection must not cross a fork
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(os.path.join(self.folder, HASHES_DB), timeout=30,
+                                         check_same_thread=False)
+            self._conn_pid = os.getpid()
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode = WAL")
+                self._conn.execute("PRAGMA synchronous = NORMAL")
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS input_hashes (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        sha256 TEXT NOT NULL,
+                        used REAL NOT NULL
+                    )""")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS input_hashes_used ON input_hashes (used)")
+        return self._conn
+
+    def remember(self, hashes):
+        """Memoise {path: (size, mtime_ns, sha256)}, e.g. MergeResult.hashes"""
+        now = time.time()
+        rows = [(os.path.abspath(path), size, mtime_ns, sha256, now)
+                for path, (size, mtime_ns, sha256) in hashes.items()]
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO input_hashes VALUES (?, ?, ?, ?, ?)", rows)
+                # Forget the least recently used files beyond max_hashes
+                conn.execute("DELETE FROM input_hashes WHERE path IN (SELECT path FROM input_hashes "
+                             "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_hashes,))
+
+    def known_key(self, pdf_files, **options):
+        """Return the key for pdf_files with options if every file's hash is memoised, else None.
+
+        Only stats the files: a file that is new, or changed since it was
+        last hashed, has to be merged (and so hashed) before its result can
+        be looked up.
+        """
+        digests = []
+        stale = False
+        with self._lock:
+            conn = self._db()
+            for pdf in pdf_files:
+                try:
+                    st = os.stat(pdf)
+                except OSError:
+                    return None
+                row = conn.execute("SELECT sha256, used FROM input_hashes WHERE path = ? AND size = ? "
+                                   "AND mtime_ns = ?", (os.path.abspath(pdf), st.st_size, st.st_mtime_ns)).fetchone()
+                if row is None:
+                    return None
+                digests.append(row[0])
+                stale = stale or row[1] < time.time() - HASH_USE_RESOLUTION
+            if stale:
+                # Recency only orders eviction, so a hit need not be written every time
+                with conn:
+                    conn.executemany("UPDATE input_hashes SET used = ? WHERE path = ?",
+                                     [(time.time(), os.path.abspath(pdf)) for pdf in pdf_files])
+        return self.key(pdf_files, digests, **options)
+
+    def key(self, pdf_files, digests, **options):
+        """Return the cache key for merging pdf_files, whose SHA-256s are digests, with options.
+
+        File names are part of the key as well as contents, since they end
+        up in the output's /SourceFiles and bookmarks.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_VERSION, sorted(options.items())]).encode())
+        for pdf, digest in zip(pdf_files, digests):
+            h.update(b"\0%s\0%s" % (os.path.basename(pdf).encode(), digest.encode()))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return (path, info) for a cached result, or None, marking it as recently used"""
+        if not KEY_RE.match(key):
+            return None
+        path = self._path(key, 'pdf')
+        try:
+            with open(self._path(key, 'json')) as f:
+                info = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return path, info
+
+    def put(self, key, source_path, info=None):
+        """Store the file at source_path under key, with the JSON-able info"""
+        path = self._path(key, 'pdf')
+        part_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            # A hard link shares the data with the job's own copy
+            os.link(source_path, part_path)
+        except OSError:
+            shutil.copyfile(source_path, part_path)
+        os.replace(part_path, path)
+        with open(part_path, 'w') as f:
+            json.dump(info or {}, f)
+        # The info file is written last: a result exists once it does
+        os.replace(part_path, self._path(key, 'json'))
+        self.evict()
+        return path
+
+    def evict(self):
+        """Remove least recently used results until the cache fits in max_bytes"""
+        with self._lock:
+            results = []
+            total = 0
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith('.pdf'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    results.append((st.st_mtime, st.st_size, entry.name[:-4]))
+                    total += st.st_size
+                elif entry.name.endswith('.part'):
+                    # Left behind by a process that died while storing a result
+                    try:
+                        if entry.stat().st_mtime < time.time() - 3600:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+            results.sort()
+            for _, size, key in results:
+                if total <= self.max_bytes:
+                    break
+                for ext in ('json', 'pdf'):
+                    try:
+                        os.remove(self._path(key, ext))
+                    except OSError:
+                        pass
+                total -= size
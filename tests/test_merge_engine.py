@@ -0,0 +1,95 @@
+"""Merges of a generated corpus must come out the same whichever way they are written.
+
+Serial, deduplicating, incremental (fresh and reused) and parallel merges
+of one corpus are compared page by page: text, bookmarks and named
+destinations, each read back with a strict PdfReader.
+"""
+import os
+import sys
+
+import pytest
+from PyPDF2 import PdfReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from corpus import make_corpus  # noqa: E402
+from merge_engine import MIN_PARALLEL_FILES, merge_files  # noqa: E402
+
+
+def outline_entries(reader, outline=None, depth=0):
+    """Flatten reader's outline into (depth, title, page number) tuples"""
+    entries = []
+    for item in reader.outline if outline is None else outline:
+        if isinstance(item, list):
+            entries.extend(outline_entries(reader, item, depth + 1))
+        else:
+            entries.append((depth, item.title, reader.get_destination_page_number(item)))
+    return entries
+
+
+def describe(path):
+    """What a merge must preserve, read with a strict reader"""
+    reader = PdfReader(path, strict=True)
+    return {
+        'pages': len(reader.pages),
+        'text': [page.extract_text() for page in reader.pages],
+        'outline': outline_entries(reader),
+        'dests': {name: reader.get_destination_page_number(dest)
+                  for name, dest in reader.named_destinations.items()},
+    }
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('corpus')
+    return make_corpus(str(folder), files=MIN_PARALLEL_FILES + 2, min_pages=1, max_pages=3, image_bytes=256,
+                       outline_depth=2, shared_image_bytes=4096, named_dests=True)
+
+
+@pytest.fixture(scope='module')
+def serial(corpus, tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('serial') / 'merged.pdf')
+    result = merge_files(corpus, output, outline=[])
+    assert result.errors == []
+    return result, describe(output)
+
+
+def test_serial_keeps_every_page_bookmark_and_destination(corpus, serial):
+    result, merged = serial
+    sources = [describe(pdf) for pdf in corpus]
+    assert result.files == len(corpus)
+    assert merged['pages'] == result.pages == sum(source['pages'] for source in sources)
+    assert merged['text'] == [text for source in sources for text in source['text']]
+    # A top-level bookmark per file, its own bookmarks nested underneath
+    assert len(merged['outline']) == len(corpus) + sum(len(source['outline']) for source in sources)
+    # Every file's "cover" is kept, renamed after the first
+    assert len(merged['dests']) == sum(len(source['dests']) for source in sources)
+    assert merged['dests']['cover'] == 0
+
+
+def test_dedup_matches_serial(corpus, serial, tmp_path):
+    output = str(tmp_path / 'merged.pdf')
+    result = merge_files(corpus, output, outline=[], dedup=True)
+    assert result.errors == []
+    assert result.bytes_saved > 0
+    assert describe(output) == serial[1]
+
+
+def test_incremental_matches_serial_and_reuses_sources(corpus, serial, tmp_path):
+    output = str(tmp_path / 'merged.pdf')
+    result = merge_files(corpus, output, outline=[], incremental=True)
+    assert result.errors == [] and result.reused == 0
+    assert describe(output) == serial[1]
+
+    result = merge_files(corpus, output, outline=[], incremental=True)
+    assert result.errors == [] and result.reused == len(corpus)
+    assert describe(output) == serial[1]
+
+
+def test_parallel_matches_serial(corpus, serial, tmp_path):
+    output = str(tmp_path / 'merged.pdf')
+    result = merge_files(corpus, output, outline=[], workers=2)
+    assert result.errors == []
+    assert describe(output) == serial[1]
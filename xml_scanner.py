@@ -0,0 +1,127 @@
+"""Streaming tag scanner for CE XML and IDML documents.
+
+Documents are fed to expat in fixed-size chunks and no tree is built, so
+memory stays constant however large the input is. IDML packages (zip
+files of XML parts) are scanned member by member.
+"""
+import shutil
+import tempfile
+import zipfile
+from collections import Counter
+from xml.parsers import expat
+
+CHUNK_SIZE = 1 << 16
+
+# Locations recorded per tag when locations are requested
+MAX_LOCATIONS = 10
+
+
+class TagScanner:
+    def __init__(self, locations=False, tags=None, max_locations=MAX_LOCATIONS):
+        self.want_locations = locations
+        self.tags = set(tags) if tags else None
+        self.max_locations = max_locations
+        self.counts = Counter()
+        self.namespaces = {}
+        self.locations = {}
+        self.documents = 0
+        self.bytes = 0
+
+    def scan(self, stream, name=None, head=b''):
+        """Scan one XML document read from stream, after the bytes in head"""
+        counts = self.counts
+        namespaces = self.namespaces
+        # Each entry is [tag, position among same-tag siblings, child tag counts]
+        stack = [[name or '', 0, {}]]
+
+        def start(tag, attrs):
+            counts[tag] += 1
+            for attr, value in attrs.items():
+                if attr == 'xmlns':
+                    namespaces.setdefault('', value)
+                elif attr.startswith('xmlns:'):
+                    namespaces.setdefault(attr[6:], value)
+            if self.want_locations:
+                siblings = stack[-1][2]
+                siblings[tag] = position = siblings.get(tag, 0) + 1
+                stack.append([tag, position, {}])
+                if self.tags is None or tag in self.tags:
+                    found = self.locations.setdefault(tag, [])
+                    if len(found) < self.max_locations:
+                        path = ''.join(f"/{t}[{i}]" for t, i, _ in stack[1:])
+                        found.append(f"{name}:{path}" if name else path)
+
+        def end(tag):
+            if self.want_locations:
+                stack.pop()
+
+        parser = expat.ParserCreate()
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            chunk = head
+            while True:
+                if chunk:
+                    self.bytes += len(chunk)
+                    parser.Parse(chunk, False)
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+            parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            where = f"{name}: " if name else ""
+            raise ValueError(f"{where}invalid XML: {e}") from None
+        self.documents += 1
+
+    def scan_package(self, f):
+        """Scan every XML part of a zip package such as IDML"""
+        try:
+            with zipfile.ZipFile(f) as package:
+                for member in package.infolist():
+                    if member.filename.lower().endswith('.xml'):
+                        with package.open(member) as part:
+                            self.scan(part, member.filename)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"invalid package: {e}") from None
+
+    def to_dict(self):
+        result = {
+            'tags': [tag for tag, _ in self.counts.most_common()],
+            'counts': dict(self.counts),
+            'namespaces': self.namespaces,
+            'elements': sum(self.counts.values()),
+            'documents': self.documents,
+            'bytes': self.bytes,
+        }
+        if self.want_locations:
+            result['locations'] = self.locations
+        return result
+
+
+def scan_stream(stream, locations=False, tags=None):
+    """Scan an XML document or IDML package read from stream and return a summary dict.
+
+    Non-seekable streams holding a zip package are spooled to a temporary
+    file on disk, since zip members can only be located from the end.
+    """
+    scanner = TagScanner(locations, tags)
+    head = stream.read(CHUNK_SIZE)
+    if head.startswith(b'PK\x03\x04'):
+        if getattr(stream, 'seekable', lambda: False)():
+            stream.seek(0)
+            scanner.scan_package(stream)
+        else:
+            with tempfile.TemporaryFile() as spool:
+                spool.write(head)
+                shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+                spool.seek(0)
+                scanner.scan_package(spool)
+    else:
+        scanner.scan(stream, head=head)
+    return scanner.to_dict()
+
+
+def scan_path(path, locations=False, tags=None):
+    with open(path, 'rb') as f:
+        return scan_stream(f, locations, tags)